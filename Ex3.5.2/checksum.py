@@ -0,0 +1,90 @@
+"""
+Checksums of datagrams, computed on bytes instead of characters,
+and a 5-byte binary header that replaces the 16-digit ASCII checksum
+"""
+import struct
+import zlib
+
+try:
+    import numpy  # Optional, faster for big payloads
+except ImportError:
+    numpy = None
+
+NUMPY_THRESHOLD = 4096  # Bytes, below it NumPy's call overhead costs more than it saves
+
+# Algorithm IDs, sent in the header
+BYTE_SUM = 0  # Sum of all bytes, like the exercise's checksum
+INTERNET = 1  # 16-bit one's complement sum (RFC 1071), like in IP, UDP and TCP headers
+CRC32 = 2  # Catches reordered bytes and burst errors, which sums don't
+
+HEADER = struct.Struct("!BI")  # Algorithm ID(1), checksum(4)
+
+
+def byte_sum(data: bytes | memoryview) -> int:
+    """
+    Sums all bytes of the data, sum() of bytes runs in C
+    :param data: The data to calculate its checksum
+    :return: The sum, wrapped to 32 bits
+    """
+    if numpy is not None and len(data) >= NUMPY_THRESHOLD:
+        total = int(numpy.frombuffer(data, dtype=numpy.uint8).sum(dtype=numpy.uint64))
+    else:
+        total = sum(data)
+    return total & 0xFFFFFFFF
+
+
+def internet_checksum(data: bytes | memoryview) -> int:
+    """
+    RFC 1071 checksum. 2**16 is 1 modulo 0xFFFF, so the one's complement sum of all
+    16-bit words is the whole data as one big number modulo 0xFFFF, done in C
+    :param data: The data to calculate its checksum
+    :return: The one's complement of the sum, 16 bits
+    """
+    if len(data) % 2:
+        data = bytes(data) + b"\0"  # Pad to whole words
+
+    if numpy is not None and len(data) >= NUMPY_THRESHOLD:
+        number = int(numpy.frombuffer(data, dtype=">u2").sum(dtype=numpy.uint64))
+    else:
+        number = int.from_bytes(data, "big")
+
+    total = number % 0xFFFF
+    if total == 0 and number:
+        total = 0xFFFF  # One's complement sums are never 0 for non-zero data
+    return ~total & 0xFFFF
+
+
+def crc32(data: bytes | memoryview) -> int:
+    """
+    :param data: The data to calculate its checksum
+    :return: The CRC32 of the data, 32 bits
+    """
+    return zlib.crc32(data)
+
+
+ALGORITHMS = {BYTE_SUM: byte_sum, INTERNET: internet_checksum, CRC32: crc32}
+
+
+def add_checksum(payload: bytes, algorithm: int = CRC32) -> bytes:
+    """
+    :param payload: The data to send
+    :param algorithm: ID of the checksum algorithm
+    :return: The header, then the payload
+    """
+    return HEADER.pack(algorithm, ALGORITHMS[algorithm](payload)) + payload
+
+
+def verify(datagram: bytes) -> memoryview | None:
+    """
+    Checks a datagram built by add_checksum(), with the algorithm in its header
+    :param datagram: The received datagram
+    :return: The payload, without copying it, None if the datagram is corrupted
+    """
+    if len(datagram) < HEADER.size:
+        return None
+    algorithm, checksum = HEADER.unpack_from(datagram)
+    calculate = ALGORITHMS.get(algorithm)
+    payload = memoryview(datagram)[HEADER.size:]
+    if calculate is None or calculate(payload) != checksum:
+        return None
+    return payload
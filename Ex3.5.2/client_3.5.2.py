@@ -3,14 +3,17 @@ Implementing timeouts & retransmissions and checksum in a UDP connection
 """
 import socket
 import random
+import struct
+import checksum
 
 IP, PORT = "loopback", 8821
 BUFFER_SIZE = 1024
-CHECKSUM_LEN = 16  # 16 bits
 TIMEOUT_IN_SECONDS = 5
+CHECKSUM_ERROR_MSG = b"Bad checksum"
+SEQ = struct.Struct("!I")  # Sequence number of every message, the server echoes it
 
 
-def special_sendto(conn: socket.socket, response: str, addr: tuple[str, int]) -> None:
+def special_sendto(conn: socket.socket, response: bytes, addr: tuple[str, int]) -> None:
     """
     A sending function provided by the course itself, to simulate packet loss
     :param conn: The socket connection
@@ -20,30 +23,20 @@ def special_sendto(conn: socket.socket, response: str, addr: tuple[str, int]) ->
     """
     fail = random.randint(1, 3)
     if not (fail == 1):
-        conn.sendto(response.encode(), addr)
+        conn.sendto(response, addr)
     else:
         print("Connection interrupted :(")
 
 
-def calc_checksum(msg_data: str) -> str:
-    """
-    Sums all the ASCII values in a given string,
-    then formats to a string with length 16
-    :param msg_data: The string to calculate its checksum
-    :return: The checksum
-    """
-    total = sum(ord(x) for x in msg_data)  # Sum of all ASCII chars
-    return str(total).rjust(CHECKSUM_LEN, "0")  # Formats to a 16-length string
-
-
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-data = ""  # Holds data and checksum
+data = ""
+seq = 0
 while data != "EXIT":
     # Get message from user and send to server
     data = input("Enter your message:\n")
-    checksum = calc_checksum(data)
-    msg = checksum + data
+    seq += 1
+    msg = checksum.add_checksum(SEQ.pack(seq) + data.encode())  # Binary header, then seq and data
 
     print("sending original...")
     special_sendto(client_socket, msg, (IP, PORT))
@@ -57,13 +50,16 @@ while data != "EXIT":
             print("Timeout exceeded! Retransmitting...")
             special_sendto(client_socket, msg, (IP, PORT))
         else:
-            # Get rid of checksum
-            server_response = server_msg.decode()[CHECKSUM_LEN:]
-            if server_response == "Bad Checksum":
+            # Validate and get rid of checksum
+            server_response = checksum.verify(server_msg)
+            if server_response is None or server_response == CHECKSUM_ERROR_MSG:
                 print("Checksum is bad, retransmitting...")
+                special_sendto(client_socket, msg, (IP, PORT))
                 continue
+            if server_response[:SEQ.size] != SEQ.pack(seq):
+                continue  # A late response to an older message
             break  # Sent successfully
 
-    print(f"Server sent: {server_response}\n")
+    print(f"Server sent: {str(server_response[SEQ.size:], 'utf-8')}\n")
 
 client_socket.close()
@@ -0,0 +1,159 @@
+"""
+Batched datagram I/O: every time the socket is readable, all waiting datagrams are
+received into preallocated buffers with recvfrom_into(), then all replies are sent
+together. No bytes object is allocated per received datagram, and the selector is
+asked once per batch instead of once per datagram
+"""
+import selectors
+import socket
+import time
+from collections import deque
+from typing import Callable, Iterator
+
+BATCH_SIZE = 64  # Max datagrams received per readiness event
+BUFFER_SIZE = 2048  # Bigger than any datagram on an Ethernet path
+RECV_BUFFER_SIZE = 4 * 1024 * 1024  # Kernel buffer, holds the datagrams between batches
+
+
+class DatagramBatcher:
+    """
+    Receives and sends datagrams of a non-blocking socket in batches.
+    Received datagrams are views into a ring of reused buffers, so they are only
+    valid until the ring wraps around to them, after BATCH_SIZE more datagrams
+    """
+
+    def __init__(self, sock: socket.socket, batch_size: int = BATCH_SIZE, buffer_size: int = BUFFER_SIZE):
+        sock.setblocking(False)
+        self.sock = sock
+        self.buffers = [memoryview(bytearray(buffer_size)) for _ in range(batch_size)]
+        self.next_buffer = 0
+        self.outgoing = deque()  # (data, address) that didn't fit in the kernel buffer yet
+        self.received = self.sent = self.batches = 0
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def receive_batch(self) -> Iterator[tuple[memoryview, tuple]]:
+        """
+        Receives the datagrams waiting in the socket, up to one per buffer of the ring
+        :return: Yields (datagram, address) of every received datagram
+        """
+        recvfrom_into = self.sock.recvfrom_into
+        buffers = self.buffers
+        index = self.next_buffer
+        count = 0
+        for _ in range(len(buffers)):
+            buffer = buffers[index]
+            try:
+                nbytes, addr = recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                continue  # An ICMP error about an earlier reply, on Windows
+            count += 1
+            index = (index + 1) % len(buffers)
+            yield buffer[:nbytes], addr
+        self.next_buffer = index
+        self.received += count
+        self.batches += 1
+
+    def queue(self, data: bytes, addr: tuple) -> None:
+        """
+        Adds a reply to the batch sent by flush()
+        :param data: The datagram, not copied
+        :param addr: Where to send it
+        :return: None
+        """
+        self.outgoing.append((data, addr))
+
+    def flush(self) -> bool:
+        """
+        Sends the queued datagrams until the kernel buffer is full
+        :return: True if all of them were sent
+        """
+        outgoing = self.outgoing
+        sendto = self.sock.sendto
+        while outgoing:
+            data, addr = outgoing[0]
+            try:
+                sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                return False  # Sent when the socket is writable again
+            except OSError as error:
+                print(f"Couldn't send to {addr[0]}:{addr[1]}: {error}")  # Dropped, like a lost datagram
+            outgoing.popleft()
+            self.sent += 1
+        return True
+
+
+def bind_socket(ip: str, port: int) -> socket.socket:
+    """
+    Creates a UDP socket for a batched server
+    :param ip: The IP to listen on
+    :param port: The port to listen on
+    :return: The bound socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+    sock.bind((ip, port))
+    return sock
+
+
+def serve(batcher: DatagramBatcher, handle: Callable[[memoryview, tuple], bytes | None],
+          interval: float | None = None, on_interval: Callable[[], None] | None = None) -> None:
+    """
+    Serves datagrams until interrupted. Every datagram is handled as soon as it is received,
+    the replies of a batch are sent after it
+    :param batcher: The server's socket
+    :param handle: Called with every datagram and its address, returns the reply or None.
+    The datagram is only valid until it returns
+    :param interval: Seconds between calls to on_interval, None to never call it
+    :param on_interval: Called every interval, for housekeeping
+    :return: None
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(batcher, selectors.EVENT_READ)
+    queue = batcher.queue
+    next_interval = time.monotonic() + interval if interval is not None else None
+    try:
+        while True:
+            timeout = max(next_interval - time.monotonic(), 0) if next_interval is not None else None
+            for key, mask in selector.select(timeout):
+                if mask & selectors.EVENT_READ:
+                    for data, addr in batcher.receive_batch():
+                        reply = handle(data, addr)
+                        if reply is not None:
+                            queue(reply, addr)
+
+            # Wait for the socket to be writable only while replies are left
+            events = selectors.EVENT_READ if batcher.flush() else selectors.EVENT_READ | selectors.EVENT_WRITE
+            if selector.get_key(batcher).events != events:
+                selector.modify(batcher, events)
+
+            if next_interval is not None and time.monotonic() >= next_interval:
+                on_interval()
+                next_interval += interval
+    finally:
+        selector.close()
+
+
+def main():
+    """
+    Answers like the UDP template server (UDP templates/server_udp.py), to any number of clients
+    """
+    batcher = DatagramBatcher(bind_socket("0.0.0.0", 8821))
+    print("Server is listening...")
+
+    def handle(data: memoryview, addr: tuple) -> bytes:
+        return b"I love " + data
+
+    try:
+        serve(batcher, handle)
+    except KeyboardInterrupt:
+        print(f"Received {batcher.received} datagrams in {batcher.batches} batches")
+    finally:
+        batcher.sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""
+Reliable datagrams over a lossy UDP path, the sliding-window version of this exercise:
+numbered packets, a window of packets in flight, selective ACKs and a retransmission
+timeout that adapts to the measured round-trip time (RFC 6298). ACKs echo the
+timestamp of the packet that triggered them (like TCP timestamps), so
+retransmitted packets are measured too
+"""
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable
+
+WINDOW_SIZE = 64  # Max packets in flight, also the size of the SACK bitmap
+MAX_PAYLOAD = 1400  # Fits in one Ethernet frame with the headers
+INITIAL_RTO = 1.0  # Seconds, before any RTT was measured
+MIN_RTO = 0.02  # Seconds, RFC 6298 says 1s, but a LAN is much faster than the internet
+MAX_RTO = 10.0
+# Max backoff of the timeout over the measured one. The course's path drops packets at random,
+# not because it's congested, so backing off without limit only slows the transfer down
+MAX_BACKOFF = 4
+CLOCK_GRANULARITY = 0.001
+DUP_THRESHOLD = 3  # A packet is retransmitted right away when this many later packets were ACKed
+
+# type(1), seq(8), send time in microseconds(4), crc32 of the other fields and the payload(4), payload
+DATA_HEADER = struct.Struct("!BQII")
+# type(1), next expected seq(8), bitmap of the WINDOW_SIZE packets after it(8),
+# echoed send time(4), crc32 of the rest(4)
+ACK_HEADER = struct.Struct("!BQQII")
+DATA_TYPE, ACK_TYPE = 0, 1
+MAX_DATAGRAM = DATA_HEADER.size + MAX_PAYLOAD
+
+
+def lossy_sendto(loss_rate: float) -> Callable[[socket.socket, bytes, tuple], None]:
+    """
+    Creates a sending function that drops some datagrams, like the course's special_sendto()
+    :param loss_rate: Between 0 and 1, the chance of every datagram to be dropped
+    :return: The sending function, called like sendto(sock, data, addr)
+    """
+    def sendto(sock: socket.socket, data: bytes, addr: tuple) -> None:
+        if random.random() >= loss_rate:
+            sock.sendto(data, addr)
+
+    return sendto
+
+
+def timestamp() -> int:
+    """
+    :return: Current monotonic time in microseconds, wrapped to 32 bits
+    """
+    return time.monotonic_ns() // 1000 & 0xFFFFFFFF
+
+
+def plain_sendto(sock: socket.socket, data: bytes, addr: tuple) -> None:
+    """
+    The default sending function, never drops datagrams on purpose
+    """
+    sock.sendto(data, addr)
+
+
+class RttEstimator:
+    """
+    Smoothed RTT and its variation, used to compute the retransmission timeout (RFC 6298)
+    """
+    __slots__ = ("srtt", "rttvar", "measured_rto", "rto")
+
+    def __init__(self):
+        self.srtt = None  # Seconds, None until the first sample
+        self.rttvar = None
+        self.measured_rto = INITIAL_RTO  # Without backoff
+        self.rto = INITIAL_RTO
+
+    def update(self, sample: float) -> None:
+        """
+        Applies an RTT sample, which also cancels a backoff
+        :param sample: The measured RTT in seconds
+        :return: None
+        """
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.measured_rto = min(max(self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar), MIN_RTO), MAX_RTO)
+        self.rto = self.measured_rto
+
+    def backoff(self) -> None:
+        """
+        Doubles the timeout after it expired, up to MAX_BACKOFF times the measured one
+        :return: None
+        """
+        self.rto = min(self.rto * 2, self.measured_rto * MAX_BACKOFF, MAX_RTO)
+
+
+class InFlightPacket:
+    """
+    A sent packet that was not ACKed yet
+    """
+    __slots__ = ("seq", "payload", "sent_at", "deadline", "later_acks")
+
+    def __init__(self, seq: int, payload: bytes):
+        self.seq = seq
+        self.payload = payload
+        self.sent_at = 0.0  # Monotonic time of the last transmission
+        self.deadline = 0.0  # Retransmitted if not ACKed by then
+        self.later_acks = 0  # ACKs of packets sent after this one, while this one was not ACKed
+
+
+class ReliableSender:
+    """
+    Sends payloads to a single peer, in order and exactly once, keeping the packets
+    in flight within window seqs of the oldest unACKed one, since the receiver
+    drops packets further ahead. send() blocks only while the window is full
+    """
+
+    def __init__(self, sock: socket.socket, peer: tuple, window: int = WINDOW_SIZE,
+                 sendto: Callable = plain_sendto):
+        """
+        :param sock: A UDP socket, used only by this sender
+        :param peer: The receiver's address
+        :param window: Max packets in flight, at most WINDOW_SIZE
+        :param sendto: Sends a datagram, see lossy_sendto()
+        """
+        if not 0 < window <= WINDOW_SIZE:
+            raise ValueError(f"window must be between 1 and {WINDOW_SIZE}")
+        self.sock = sock
+        self.peer = peer
+        self.window = window
+        self.sendto = sendto
+        self.next_seq = 0
+        self.in_flight = {}  # Seq to its InFlightPacket, oldest first
+        self.rtt = RttEstimator()
+        self.retransmissions = 0
+
+    def send(self, payload: bytes) -> None:
+        """
+        Sends a payload, first waits for ACKs if the window is full
+        :param payload: At most MAX_PAYLOAD bytes
+        :return: None
+        """
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError(f"payload is longer than {MAX_PAYLOAD} bytes")
+        # SACKed packets leave in_flight, but the window can't slide past an older hole
+        while self.in_flight and self.next_seq - next(iter(self.in_flight)) >= self.window:
+            self.wait_for_acks()
+
+        packet = self.in_flight[self.next_seq] = InFlightPacket(self.next_seq, payload)
+        self.transmit(packet, time.monotonic())
+        self.next_seq += 1
+
+    def flush(self) -> None:
+        """
+        Blocks until every sent payload is ACKed
+        :return: None
+        """
+        while self.in_flight:
+            self.wait_for_acks()
+
+    def wait_for_acks(self) -> None:
+        """
+        Waits for an ACK until the earliest retransmission deadline,
+        then handles it, or retransmits the packets whose deadline passed
+        :return: None
+        """
+        timeout = min(packet.deadline for packet in self.in_flight.values()) - time.monotonic()
+        if timeout <= 0:
+            self.retransmit_expired()
+            return
+
+        self.sock.settimeout(timeout)
+        try:
+            datagram = self.sock.recv(ACK_HEADER.size)
+        except TimeoutError:  # socket.timeout is deprecated
+            self.retransmit_expired()
+            return
+        self.handle_ack(datagram)
+
+    def transmit(self, packet: InFlightPacket, now: float) -> None:
+        """
+        Sends a packet, stamped with the current time
+        :param packet: The packet to send
+        :param now: Current monotonic time
+        :return: None
+        """
+        packet.later_acks = 0
+        packet.sent_at = now
+        packet.deadline = now + self.rtt.rto
+        header = DATA_HEADER.pack(DATA_TYPE, packet.seq, timestamp(), 0)[:-4]
+        checksum = zlib.crc32(packet.payload, zlib.crc32(header))
+        self.sendto(self.sock, header + checksum.to_bytes(4, "big") + packet.payload, self.peer)
+
+    def retransmit(self, packet: InFlightPacket, now: float) -> None:
+        """
+        :param packet: The packet to send again
+        :param now: Current monotonic time
+        :return: None
+        """
+        self.transmit(packet, now)
+        self.retransmissions += 1
+
+    def retransmit_expired(self) -> None:
+        """
+        The timeout expired: backs off, then retransmits every expired packet
+        :return: None
+        """
+        self.rtt.backoff()
+        now = time.monotonic()
+        for packet in self.in_flight.values():
+            if packet.deadline <= now:
+                self.retransmit(packet, now)
+
+    def handle_ack(self, datagram: bytes) -> None:
+        """
+        Samples the RTT, removes the acknowledged packets from the window and
+        retransmits packets that packets sent after them overtook DUP_THRESHOLD times
+        :param datagram: The received datagram
+        :return: None
+        """
+        if len(datagram) != ACK_HEADER.size:
+            return
+        packet_type, next_expected, bitmap, echoed, checksum = ACK_HEADER.unpack(datagram)
+        if packet_type != ACK_TYPE or zlib.crc32(datagram[:-4]) != checksum:
+            return  # Corrupted, the next ACK will tell the same
+
+        now = time.monotonic()
+        self.rtt.update(((timestamp() - echoed) & 0xFFFFFFFF) / 1e6)
+        acked = [seq for seq in self.in_flight
+                 if seq < next_expected or (seq > next_expected and (bitmap >> (seq - next_expected - 1)) & 1)]
+        if not acked:
+            return
+
+        newest_acked = max(self.in_flight.pop(seq).sent_at for seq in acked)
+        for packet in self.in_flight.values():
+            # A retransmitted packet is only compared with packets sent after it
+            if packet.sent_at < newest_acked:
+                packet.later_acks += 1
+                if packet.later_acks == DUP_THRESHOLD:
+                    self.retransmit(packet, now)  # Fast retransmit, no need to wait for the timeout
+
+
+class PeerState:
+    """
+    What a receiver knows about one sender
+    """
+    __slots__ = ("next_expected", "out_of_order")
+
+    def __init__(self):
+        self.next_expected = 0  # Every packet before it was delivered
+        self.out_of_order = {}  # Seq to payload, of packets that arrived after a gap
+
+
+class ReliableReceiver:
+    """
+    Receives payloads from any number of senders, delivers each sender's
+    payloads in order and without duplicates, ACKing every data packet
+    """
+
+    def __init__(self, sock: socket.socket, sendto: Callable = plain_sendto):
+        """
+        :param sock: A bound UDP socket, used only by this receiver
+        :param sendto: Sends a datagram, see lossy_sendto()
+        """
+        self.sock = sock
+        self.sendto = sendto
+        self.peers = {}  # Address to its PeerState
+        self.delivered = deque()  # In-order (payload, address) not returned by recv() yet
+
+    def recv(self) -> tuple[bytes, tuple]:
+        """
+        Blocks until the next in-order payload of some sender
+        :return: The payload and its sender's address
+        """
+        while not self.delivered:
+            datagram, addr = self.sock.recvfrom(MAX_DATAGRAM)
+            self.handle_data(datagram, addr)
+        return self.delivered.popleft()
+
+    def handle_data(self, datagram: bytes, addr: tuple) -> None:
+        """
+        Buffers a data packet, delivers what became in order, then ACKs
+        :param datagram: The received datagram
+        :param addr: The sender's address
+        :return: None
+        """
+        if len(datagram) < DATA_HEADER.size:
+            return
+        packet_type, seq, sent_at, checksum = DATA_HEADER.unpack_from(datagram)
+        payload = datagram[DATA_HEADER.size:]
+        if packet_type != DATA_TYPE or zlib.crc32(payload, zlib.crc32(datagram[:DATA_HEADER.size - 4])) != checksum:
+            return  # Corrupted, the sender will retransmit
+
+        peer = self.peers.get(addr)
+        if peer is None:
+            peer = self.peers[addr] = PeerState()
+
+        if seq == peer.next_expected:
+            self.delivered.append((payload, addr))
+            peer.next_expected += 1
+            # Deliver packets that waited for this one
+            while peer.next_expected in peer.out_of_order:
+                self.delivered.append((peer.out_of_order.pop(peer.next_expected), addr))
+                peer.next_expected += 1
+        elif peer.next_expected < seq <= peer.next_expected + WINDOW_SIZE:
+            peer.out_of_order[seq] = payload
+        # Older packets are duplicates, their ACK was lost, so they are only ACKed again
+
+        self.send_ack(peer, addr, sent_at)
+
+    def send_ack(self, peer: PeerState, addr: tuple, sent_at: int) -> None:
+        """
+        ACKs everything before next_expected, and every buffered packet in the bitmap
+        :param peer: The sender's state
+        :param addr: The sender's address
+        :param sent_at: Timestamp of the packet that is ACKed, echoed for RTT measuring
+        :return: None
+        """
+        bitmap = 0
+        for seq in peer.out_of_order:
+            bitmap |= 1 << (seq - peer.next_expected - 1)
+        ack = ACK_HEADER.pack(ACK_TYPE, peer.next_expected, bitmap, sent_at, 0)[:-4]
+        self.sendto(self.sock, ack + zlib.crc32(ack).to_bytes(4, "big"), addr)
+
+
+def main():
+    """
+    Sends the same messages over a lossy loopback path with growing windows
+    """
+    num_messages = 500
+    loss_rate = 1 / 3  # Like special_sendto()
+    payload = b"x" * 1000
+
+    for window in (1, 8, 64):
+        receiver_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver_socket.bind(("127.0.0.1", 0))
+        receiver_socket.settimeout(0.05)
+        receiver = ReliableReceiver(receiver_socket, lossy_sendto(loss_rate))
+        received = []
+        done = threading.Event()
+
+        def receive_all() -> None:
+            # Keeps ACKing until the sender is done, the last ACKs may be lost too
+            while not done.is_set():
+                try:
+                    received.append(receiver.recv())
+                except TimeoutError:
+                    pass
+
+        thread = threading.Thread(target=receive_all, daemon=True)
+        thread.start()
+
+        sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender = ReliableSender(sender_socket, receiver_socket.getsockname(), window, lossy_sendto(loss_rate))
+        start = time.perf_counter()
+        for index in range(num_messages):
+            sender.send(index.to_bytes(4, "big") + payload)
+        sender.flush()
+        elapsed = time.perf_counter() - start
+        done.set()
+        thread.join()
+        received.extend(receiver.delivered)  # Delivered after the thread's last recv()
+
+        in_order = [int.from_bytes(data[:4], "big") for data, _ in received] == list(range(num_messages))
+        print(f"Window {window:>2}: {num_messages / elapsed:>7.0f} messages/s, "
+              f"{sender.retransmissions} retransmissions, in order: {in_order}")
+        sender_socket.close()
+        receiver_socket.close()
+
+
+if __name__ == '__main__':
+    main()
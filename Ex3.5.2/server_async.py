@@ -0,0 +1,153 @@
+"""
+A concurrent version of server_3.5.2: one asyncio protocol serves every client at once.
+Each client's last sequence number and response are kept, so a retransmitted message
+gets the cached response instead of being handled twice
+"""
+import asyncio
+import socket
+import struct
+import time
+import checksum
+
+IP, PORT = "0.0.0.0", 8821
+RECV_BUFFER_SIZE = 4 * 1024 * 1024  # Kernel buffer, holds bursts from many clients
+PEER_TIMEOUT = 60  # Seconds, a client's state is forgotten after it is silent this long
+PRINT_MESSAGES = False  # Printing every message is slower than handling it
+CHECKSUM_ERROR_MSG = b"Bad checksum"
+SEQ = struct.Struct("!I")  # Every message starts with the client's sequence number
+
+
+class Peer:
+    """
+    What the server remembers about a client
+    """
+    __slots__ = ("last_seq", "last_response", "last_seen")
+
+    def __init__(self):
+        self.last_seq = -1  # No message handled yet
+        self.last_response = None  # Sent again if the client retransmits its last message
+        self.last_seen = 0.0
+
+
+class ChecksumEcho:
+    """
+    Echoes valid messages back with their sequence number, remembers every client's
+    last message. Shared by the asyncio server and the batched one (server_batched.py)
+    """
+
+    def __init__(self):
+        self.peers = {}  # Address to its Peer
+        self.handled = self.duplicates = self.corrupted = 0
+
+    def handle_datagram(self, data: bytes | memoryview, addr: tuple, now: float) -> bytes | None:
+        """
+        Validates a client's message, then builds its response
+        :param data: The received datagram, not used after returning
+        :param addr: The client's address
+        :param now: Current monotonic time
+        :return: The response, None if nothing should be sent
+        """
+        payload = checksum.verify(data)
+        if payload is None:
+            self.corrupted += 1
+            return checksum.add_checksum(CHECKSUM_ERROR_MSG)  # The client will retransmit
+        if len(payload) < SEQ.size:
+            return None
+
+        peer = self.peers.get(addr)
+        if peer is None:
+            peer = self.peers[addr] = Peer()
+        peer.last_seen = now
+
+        seq, = SEQ.unpack_from(payload)
+        if seq == peer.last_seq:
+            self.duplicates += 1
+            return peer.last_response  # The response was lost, send it again
+        if seq < peer.last_seq:
+            return None  # A late copy of an older message, its response was already received
+
+        self.handled += 1
+        if PRINT_MESSAGES:
+            print(f"{addr[0]}:{addr[1]} sent: {str(payload[SEQ.size:], 'utf-8', errors='replace')}")
+        peer.last_seq = seq
+        peer.last_response = checksum.add_checksum(bytes(payload))  # Echo with the same seq
+        return peer.last_response
+
+    def forget_silent_peers(self, now: float) -> None:
+        """
+        Drops the state of clients that were silent for PEER_TIMEOUT
+        :param now: Current monotonic time
+        :return: None
+        """
+        deadline = now - PEER_TIMEOUT
+        self.peers = {addr: peer for addr, peer in self.peers.items() if peer.last_seen > deadline}
+        print(f"Clients: {len(self.peers)}, handled: {self.handled}, "
+              f"duplicates: {self.duplicates}, corrupted: {self.corrupted}")
+
+
+class ChecksumEchoProtocol(asyncio.DatagramProtocol):
+    """
+    Serves ChecksumEcho over asyncio. Datagrams received in the same loop
+    iteration are handled together, then their responses are sent
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.echo = ChecksumEcho()
+        self.pending = []  # (datagram, address) received in this loop iteration
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+        asyncio.get_running_loop().call_later(PEER_TIMEOUT, self.forget_silent_peers)
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        if not self.pending:
+            asyncio.get_running_loop().call_soon(self.handle_pending)
+        self.pending.append((data, addr))
+
+    def handle_pending(self) -> None:
+        """
+        Handles the batch of received datagrams, then sends their responses
+        :return: None
+        """
+        batch, self.pending = self.pending, []
+        now = time.monotonic()
+        sendto = self.transport.sendto
+        handle_datagram = self.echo.handle_datagram
+        for data, addr in batch:
+            response = handle_datagram(data, addr, now)
+            if response is not None:
+                sendto(response, addr)
+
+    def forget_silent_peers(self) -> None:
+        """
+        Runs ChecksumEcho.forget_silent_peers() every PEER_TIMEOUT
+        :return: None
+        """
+        self.echo.forget_silent_peers(time.monotonic())
+        asyncio.get_running_loop().call_later(PEER_TIMEOUT, self.forget_silent_peers)
+
+
+async def serve() -> None:
+    """
+    Serves clients until cancelled
+    :return: None
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+    server_socket.bind((IP, PORT))
+
+    transport, _protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+        ChecksumEchoProtocol, sock=server_socket)
+    print("Server is listening...")
+    try:
+        await asyncio.Future()  # Forever
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("Server is shutting down...")
@@ -0,0 +1,28 @@
+"""
+The concurrent checksum echo server of server_async.py, on batched datagram I/O:
+every readiness event receives all waiting datagrams into reused buffers
+"""
+import time
+import datagram_io
+from server_async import ChecksumEcho, IP, PORT, PEER_TIMEOUT
+
+
+def main():
+    echo = ChecksumEcho()
+    batcher = datagram_io.DatagramBatcher(datagram_io.bind_socket(IP, PORT))
+    print("Server is listening...")
+
+    def handle(data: memoryview, addr: tuple) -> bytes | None:
+        return echo.handle_datagram(data, addr, time.monotonic())
+
+    try:
+        datagram_io.serve(batcher, handle, PEER_TIMEOUT, lambda: echo.forget_silent_peers(time.monotonic()))
+    except KeyboardInterrupt:
+        print("Server is shutting down...")
+    finally:
+        print(f"Received {batcher.received} datagrams in {batcher.batches} batches")
+        batcher.sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Throughput baseline of the bartender echo server: starts server_bartender on localhost,
+then runs many asyncio clients that send messages and wait for their echo.
+Runs once with the echo fast path and once without it, reports both
+"""
+import asyncio
+import multiprocessing
+import sys
+import time
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+SERVER_IP = "127.0.0.1"
+SERVER_PORT = 5556  # Not the real server's port
+NUM_CLIENTS = 100
+ROUNDS = 1000  # Messages per client, each one waits for the echo of the previous one
+MESSAGE_SIZE = 1024
+STARTUP_TIMEOUT = 10
+
+
+def run_server(fast_path: bool) -> None:
+    """
+    Runs in the server process: overrides server_bartender's settings, then starts it
+    :param fast_path: Value of ECHO_FAST_PATH
+    :return: None
+    """
+    import server_bartender
+    server_bartender.IP, server_bartender.PORT = SERVER_IP, SERVER_PORT
+    server_bartender.ECHO_FAST_PATH = fast_path
+    server_bartender.LOG_MESSAGES = server_bartender.LOG_CLIENTS = False
+    server_bartender.main()
+
+
+async def connect() -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Connects to the server, retrying while it starts
+    :return: The connection's reader and writer
+    """
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            return await asyncio.open_connection(SERVER_IP, SERVER_PORT)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run_client(rounds: int, latencies: list[float]) -> None:
+    """
+    Sends messages one after the other, each after the echo of the previous one
+    :param rounds: Num of messages
+    :param latencies: Round-trip times are added to it
+    :return: None
+    """
+    reader, writer = await connect()
+    message = bytes(MESSAGE_SIZE)
+    for _ in range(rounds):
+        start = time.perf_counter()
+        writer.write(message)
+        await reader.readexactly(MESSAGE_SIZE)  # The echo may come in parts
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_load() -> tuple[list[float], float]:
+    """
+    Runs all clients at once
+    :return: Round-trip times, total seconds
+    """
+    _reader, writer = await connect()  # Wait for the server to start
+    writer.close()
+    await writer.wait_closed()
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(ROUNDS, latencies) for _ in range(NUM_CLIENTS)))
+    return latencies, time.perf_counter() - start
+
+
+def children_cpu_time() -> float:
+    """
+    :return: CPU seconds used by the ended child processes, 0 if unknown
+    """
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def benchmark(fast_path: bool) -> None:
+    """
+    Starts the server, runs the clients against it, then prints the results
+    :param fast_path: Value of the server's ECHO_FAST_PATH
+    :return: None
+    """
+    cpu_before = children_cpu_time()
+    server = multiprocessing.Process(target=run_server, args=(fast_path,), name="server")
+    server.start()
+    try:
+        latencies, elapsed = asyncio.run(run_load())
+    finally:
+        server.terminate()
+        server.join()
+    server_cpu = children_cpu_time() - cpu_before  # Fairer than throughput when clients share the CPU
+
+    latencies.sort()
+    print(f"Fast path: {fast_path}")
+    print(f"\t{len(latencies) / elapsed:.0f} messages/s, "
+          f"{2 * len(latencies) * MESSAGE_SIZE / elapsed / 1e6:.1f} MB/s (both directions)")
+    print(f"\tLatency: p50 {latencies[len(latencies) // 2] * 1e3:.2f}ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.2f}ms")
+    if server_cpu:
+        print(f"\tServer CPU: {server_cpu / len(latencies) * 1e6:.1f}us per message")
+
+
+def main():
+    print(f"Clients: {NUM_CLIENTS}, rounds: {ROUNDS}, message size: {MESSAGE_SIZE} bytes")
+    for fast_path in (True, False):
+        benchmark(fast_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        NUM_CLIENTS = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        MESSAGE_SIZE = int(sys.argv[2])
+    main()
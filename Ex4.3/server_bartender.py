@@ -1,93 +1,90 @@
 """
 A TCP echo server that can handle multiple TCP sockets
 """
+import os
 import socket
-import select
+import sys
+
+# The server core is shared with the TCP templates
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "TCP templates"))
+import tcp_server
 
 IP, PORT = "0.0.0.0", 5555
-BUFFER_SIZE = 1024
+ECHO_FAST_PATH = True  # Echo the received bytes as they are, without decoding them or copying them first
+LOG_MESSAGES = False  # Printing every message is much slower than echoing it
+LOG_CLIENTS = True  # Print the connected clients whenever one connects or disconnects
 
 
-def print_clients_sockets(sockets: list[socket.socket]) -> None:
+class BartenderServer(tcp_server.TCPServer):
     """
-    Prints all sockets details in a given list of sockets
-    :param sockets: The list of the sockets
-    :return: None
+    Echoes back every message to the client that sent it
     """
-    print("\nConnected clients:")
-    if sockets:
-        for client in sockets:
-            print(f"\t{client.getpeername()}")
-    else:
-        print("\tNo clients connected!")
-    print()  # Newline
 
+    def print_clients_sockets(self) -> None:
+        """
+        Prints the details of all connected clients
+        :return: None
+        """
+        print("\nConnected clients:")
+        if self.connections:
+            for client in self.connections.values():
+                print(f"\t{client}")
+        else:
+            print("\tNo clients connected!")
+        print()  # Newline
 
-def close_socket(conn: socket.socket, client_sockets: list[socket.socket]) -> None:
-    """
-    Closes a client socket and removes it from the list,
-    then prints connected clients
-    :param conn: The socket connection to close
-    :param client_sockets: The list of all client sockets
-    :return: None
-    """
-    try:
-        client_address = conn.getpeername()
-    except OSError:
-        # The client was forced-closed
-        client_address = "unknown"
-    client_sockets.remove(conn)
-    conn.close()
-    print(f"Connection closed for client {client_address}")
-    print_clients_sockets(client_sockets)
+    def handle_connect(self, connection: tcp_server.Connection) -> None:
+        if LOG_CLIENTS:
+            self.print_clients_sockets()
+
+    def read(self, connection: tcp_server.Connection) -> None:
+        if not ECHO_FAST_PATH:
+            super().read(connection)
+            return
+
+        data = self.receive(connection)  # A slice of the server's reused buffer
+        if data is None:
+            return
+        if LOG_MESSAGES:
+            print(f"{connection} sent: {str(data, 'utf-8', errors='replace')}")
+
+        sent = 0
+        if not connection.outgoing:  # Else older data must be sent first
+            try:
+                sent = connection.conn.send(data)
+            except BlockingIOError:
+                pass  # Kernel buffer is full
+            except tcp_server.DISCONNECT_ERRORS:
+                self.close(connection)
+                return
+            self.bytes_out += sent
+        if sent < len(data):
+            # The rest waits in the client's pending queue, copied since the buffer is reused
+            self.send(connection, bytes(data[sent:]))
+
+    def handle_data(self, connection: tcp_server.Connection) -> None:
+        # Handle echo back to client, sent when the client is ready to receive it
+        data = bytes(connection.recv_buffer)
+        connection.recv_buffer.clear()
+        if LOG_MESSAGES:
+            print(f"{connection} sent: {data.decode(errors='replace')}")
+        self.send(connection, data)
+
+    def handle_disconnect(self, connection: tcp_server.Connection) -> None:
+        if LOG_CLIENTS:
+            print(f"Connection closed for client {connection}")
+            self.print_clients_sockets()
 
 
 def main():
     # Create a TCP socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((IP, PORT))
-    server_socket.listen()
+    server_socket = socket.create_server((IP, PORT))
     print("Server is up, listening...")
 
-    client_sockets = []
-    unsent_messages = []  # In case client isn't ready to receive messages
-    while True:
-        ready_to_read, ready_to_write, _ = select.select(
-            [server_socket] + client_sockets, client_sockets, [])
-
-        # Scan the ready-to-read sockets
-        for current_socket in ready_to_read:
-            if current_socket is server_socket:
-                # Add new clients
-                client_socket, _ = current_socket.accept()
-                client_sockets.append(client_socket)
-                print_clients_sockets(client_sockets)
-            else:
-                # Handle clients
-                try:
-                    data = current_socket.recv(BUFFER_SIZE).decode()
-                except (ConnectionResetError, ConnectionAbortedError):
-                    close_socket(current_socket, client_sockets)
-                    continue
-
-                if not bool(data):  # More optimized than data == ""
-                    # Client wants to disconnect
-                    close_socket(current_socket, client_sockets)
-                else:
-                    # Handle echo back to client
-                    print(f"{current_socket.getpeername()} sent: {data}")
-                    if current_socket in ready_to_write:
-                        current_socket.send(data.encode())
-                    else:
-                        # Send it in future iterations
-                        unsent_messages.append((current_socket, data))
-
-        # Send messages if client isn't occupied
-        for msg in unsent_messages:
-            current_socket, data = msg
-            if current_socket in ready_to_write:
-                current_socket.send(data.encode())
-                unsent_messages.remove(msg)
+    try:
+        BartenderServer(server_socket).serve_forever()
+    except KeyboardInterrupt:
+        print("Server is shutting down...")
 
 
 if __name__ == '__main__':
@@ -1,26 +1,38 @@
 import socket
+import tcp_server
 
 IP, PORT = "0.0.0.0", 8820
-END_MSG = "Quit"
+END_MSG = b"Quit"
 
-# Create a TCP socket
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind((IP, PORT))
 
-server_socket.listen()
-print("Server is up and running")
+class EchoServer(tcp_server.TCPServer):
+    """
+    Echoes back data to every client, until it sends END_MSG
+    """
+
+    def handle_connect(self, connection: tcp_server.Connection) -> None:
+        print(f"Client {connection} connected")
+
+    def handle_data(self, connection: tcp_server.Connection) -> None:
+        data = bytes(connection.recv_buffer)
+        connection.recv_buffer.clear()
+        print(f"Client sent: {data.decode(errors='replace')}")
+        if data == END_MSG:
+            self.send(connection, b"Bye")
+            self.flush(connection)
+            self.close(connection)
+        else:
+            self.send(connection, data)
 
-client_socket, client_address = server_socket.accept()
-print(f"Client {client_address} connected")
+    def handle_disconnect(self, connection: tcp_server.Connection) -> None:
+        print(f"Client {connection} disconnected")
 
-while True:
-    # Echo back data to client, if not END_MSG
-    data = client_socket.recv(1024).decode()
-    print(f"Client sent: {data}")
-    if data == END_MSG:
-        client_socket.send("Bye".encode())
-        break
-    client_socket.send(data.encode())
 
-client_socket.close()
-server_socket.close()
+# Create a TCP socket
+server_socket = socket.create_server((IP, PORT))
+print("Server is up and running")
+
+try:
+    EchoServer(server_socket).serve_forever()
+except KeyboardInterrupt:
+    print("Server is shutting down")
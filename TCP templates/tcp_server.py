@@ -0,0 +1,444 @@
+"""
+A multi-client TCP server core, shared by the echo template, the bartender and the trivia servers.
+One selectors loop serves every client: non-blocking reads into per-connection buffers,
+per-connection write queues sent with scatter-gather writes, back-pressure on clients
+that don't read their responses, a connection limit, closing only the client
+whose handling failed, and a graceful shutdown.
+Servers subclass TCPServer and override its handle_*() methods
+"""
+import errno
+import itertools
+import logging
+import os
+import selectors
+import socket
+import time
+from collections import deque
+from typing import Callable
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+BUFFER_SIZE = 64 * 1024  # Max bytes received per read
+MAX_CONNECTIONS = 10_000  # New clients wait in the listen backlog while this many are connected
+MAX_RECV_BUFFERED = 1024 * 1024  # A client is dropped if this many bytes are buffered without being handled
+MAX_OUTGOING = 4 * 1024 * 1024  # A client isn't read from while this many bytes wait to be sent to it
+FLUSH_THRESHOLD = 64 * 1024  # While corked, a queue is sent right away once it has this many bytes
+SHUTDOWN_TIMEOUT = 5  # Seconds to send what's left to clients when the server stops
+ACCEPT_BACKOFF = 0.1  # Seconds without accepting after running out of file descriptors or memory
+RESERVED_FILES = 64  # File descriptors kept for the server's own files, like its logs, storage and pools
+# Buffers per sendmsg() call, 0 if scatter-gather writes aren't available
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") and hasattr(socket.socket, "sendmsg") else 0
+
+DISCONNECT_ERRORS = (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+# accept() errors of a process or system out of resources, the client stays in the backlog
+RESOURCE_ERRORS = (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM)
+
+
+def raise_open_files_limit() -> int | None:
+    """
+    Raises the soft limit of open files to the hard limit, since every client needs a socket
+    :return: The limit, None if unknown or unlimited
+    """
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass  # Like macOS, which refuses an unlimited soft limit
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+class Connection:
+    """
+    A connected client: its socket and buffers. Servers may subclass it to add their own state
+    """
+    __slots__ = ("conn", "address", "recv_buffer", "outgoing", "outgoing_size",
+                 "waiting_to_write", "paused", "last_active")
+
+    def __init__(self, conn: socket.socket, address: tuple):
+        """
+        :param conn: The client's socket
+        :param address: The client's IP and port, as returned by accept()
+        """
+        self.conn = conn
+        self.address = address
+        self.recv_buffer = bytearray()  # Bytes received that were not handled yet, like incomplete messages
+        self.outgoing = deque()  # Memoryviews waiting to be sent
+        self.outgoing_size = 0  # Num of bytes in the outgoing queue
+        self.waiting_to_write = False  # Registered for EVENT_WRITE, the kernel buffer was full
+        self.paused = False  # Not read from until its outgoing queue drains, see MAX_OUTGOING
+        self.last_active = time.monotonic()  # When the client last sent data
+
+    @property
+    def closed(self) -> bool:
+        return self.conn.fileno() == -1
+
+    def __repr__(self) -> str:
+        return "{}:{}".format(*self.address[:2])
+
+
+class TCPServer:
+    """
+    Serves many TCP clients from one thread. Subclasses override:
+    handle_connect(), handle_data() (parses and handles the connection's recv_buffer),
+    handle_disconnect() and handle_iteration() (housekeeping at the end of every loop iteration)
+    """
+    connection_class = Connection
+
+    def __init__(self, server_socket: socket.socket, max_connections: int = MAX_CONNECTIONS,
+                 cork: bool = True, flush_threshold: int = FLUSH_THRESHOLD):
+        """
+        :param server_socket: The listening socket, see socket.create_server()
+        :param max_connections: Max connected clients, lowered to fit in the open files limit
+        :param cork: Hold responses until the end of the loop iteration, then send them together
+        :param flush_threshold: While corked, a queue is sent right away once it has this many bytes
+        """
+        self.server_socket = server_socket
+        open_files = raise_open_files_limit()
+        if open_files is not None:
+            max_connections = max(1, min(max_connections, open_files - RESERVED_FILES))
+        self.max_connections = max_connections
+        self.cork = cork
+        self.flush_threshold = flush_threshold
+        self.connections = {}  # The Connection of each client socket
+        self.to_flush = set()  # Connections that got new data to send in this loop iteration
+        self.watched = {}  # Callbacks of other watched files, like a JobRunner
+        self.selector = selectors.DefaultSelector()  # epoll/kqueue when available, O(1) per ready socket
+        self.accepting = False
+        self.resume_accepting_at = None  # Monotonic time to accept again after accept() ran out of resources
+        self.recv_view = memoryview(bytearray(BUFFER_SIZE))  # Every read goes here first
+        self.bytes_in = self.bytes_out = 0
+
+    # Overridden by servers
+
+    def handle_connect(self, connection: Connection) -> None:
+        """
+        Called when a client connects
+        """
+
+    def handle_data(self, connection: Connection) -> None:
+        """
+        Called after new data was appended to the connection's recv_buffer.
+        Removes what it handled from the buffer, the rest stays for the next call
+        """
+        connection.recv_buffer.clear()
+
+    def handle_disconnect(self, connection: Connection) -> None:
+        """
+        Called after a client's socket was closed, by either side
+        """
+
+    def handle_iteration(self) -> None:
+        """
+        Called at the end of every loop iteration, before the corked responses are sent
+        """
+
+    def before_flush(self) -> None:
+        """
+        Called before responses are sent right away, like when a queue reaches the flush threshold
+        """
+
+    # Sending
+
+    def send(self, connection: Connection, data: bytes) -> None:
+        """
+        Queues data to a client. While corked, queues are sent at the end of the
+        loop iteration, or once they reach the flush threshold
+        :param connection: The client's connection
+        :param data: The data to send, not copied, so it must not be changed later
+        :return: None
+        """
+        if connection.closed:
+            return  # Client disconnected
+
+        connection.outgoing.append(memoryview(data))
+        connection.outgoing_size += len(data)
+
+        if connection.waiting_to_write:
+            if not connection.paused and connection.outgoing_size >= MAX_OUTGOING:
+                self.update_events(connection)  # Stop reading from a client that doesn't read
+            return  # The selector will tell when there is room
+        if not self.cork or connection.outgoing_size >= self.flush_threshold:
+            self.before_flush()
+            self.flush(connection)
+        else:
+            self.to_flush.add(connection)
+
+    def send_queue(self, conn: socket.socket, queue: deque[memoryview]) -> int:
+        """
+        Sends queued data of a socket, all of it in one sendmsg() call
+        when possible (up to IOV_MAX buffers), else one send() per buffer.
+        Sent buffers are removed from the queue, a partly sent buffer
+        stays at its head
+        :param conn: The socket connection
+        :param queue: The socket's outgoing queue
+        :return: Num of bytes sent
+        """
+        if IOV_MAX:
+            sent = conn.sendmsg(itertools.islice(queue, IOV_MAX))  # Scatter-gather write
+        else:
+            sent = conn.send(queue[0])
+
+        self.bytes_out += sent
+        total_sent = sent
+        while sent:
+            head_len = len(queue[0])
+            if sent < head_len:
+                queue[0] = queue[0][sent:]
+                break
+            queue.popleft()
+            sent -= head_len
+        return total_sent
+
+    def flush(self, connection: Connection) -> None:
+        """
+        Sends queued data of a connection until its queue is empty or the
+        kernel buffer is full (EAGAIN). The socket waits for EVENT_WRITE
+        only while data is left, and isn't read from while too much is left
+        :param connection: The client's connection
+        :return: None
+        """
+        conn, queue = connection.conn, connection.outgoing
+        try:
+            while queue:
+                connection.outgoing_size -= self.send_queue(conn, queue)
+        except BlockingIOError:
+            pass  # Kernel buffer is full
+        except DISCONNECT_ERRORS:
+            self.close(connection)
+            return
+        except OSError as error:  # Like TimeoutError
+            logging.warning("Sending to %s failed, closing it: %s", connection, error)
+            self.close(connection)
+            return
+
+        self.update_events(connection)
+
+    def update_events(self, connection: Connection) -> None:
+        """
+        Registers a connection for EVENT_WRITE only while data is left to send,
+        and for EVENT_READ only while less than MAX_OUTGOING bytes are left
+        :param connection: The client's connection
+        :return: None
+        """
+        waiting_to_write = bool(connection.outgoing)
+        paused = connection.outgoing_size >= MAX_OUTGOING
+        if waiting_to_write != connection.waiting_to_write or paused != connection.paused:
+            connection.waiting_to_write, connection.paused = waiting_to_write, paused
+            events = (0 if paused else selectors.EVENT_READ) | (selectors.EVENT_WRITE if waiting_to_write else 0)
+            self.selector.modify(connection.conn, events, connection)
+
+    def flush_pending(self) -> None:
+        """
+        Sends the queues that got new data in this loop iteration.
+        Connections waiting for EVENT_WRITE are left for the selector
+        :return: None
+        """
+        to_flush = self.to_flush
+        while to_flush:
+            connection = to_flush.pop()  # flush() may drop other connections from the set
+            if not connection.waiting_to_write:
+                self.flush(connection)
+
+    # Connections
+
+    def accept(self) -> None:
+        """
+        Accepts a new client, creates its connection and registers it in the selector for reading
+        :return: None
+        """
+        try:
+            client_socket, client_address = self.server_socket.accept()
+        except (BlockingIOError, InterruptedError, ConnectionAbortedError):
+            return  # The client left the backlog before being accepted
+        except OSError as error:
+            if error.errno not in RESOURCE_ERRORS:
+                raise
+            # Accepting again right away would fail the same way and spin the loop, so new clients
+            # wait in the backlog until a client disconnects or ACCEPT_BACKOFF passes
+            logging.warning("Can't accept clients for now: %s", error)
+            self.stop_accepting()
+            self.resume_accepting_at = time.monotonic() + ACCEPT_BACKOFF
+            return
+        try:
+            client_socket.setblocking(False)  # Never block the loop on a slow client
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Responses are already batched
+        except OSError:
+            client_socket.close()
+            return  # The client already left
+        connection = self.connection_class(client_socket, client_address)
+        self.connections[client_socket] = connection
+        self.selector.register(client_socket, selectors.EVENT_READ, connection)  # The selector hands it back
+        if len(self.connections) >= self.max_connections:
+            self.stop_accepting()
+        try:
+            self.handle_connect(connection)
+        except Exception:
+            logging.exception("Connecting %s failed, closing it", connection)
+            self.close(connection)
+
+    def start_accepting(self) -> None:
+        self.resume_accepting_at = None
+        if not self.accepting:
+            self.server_socket.setblocking(False)
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
+            self.accepting = True
+
+    def stop_accepting(self) -> None:
+        """
+        Leaves new clients in the listen backlog, until a client disconnects
+        :return: None
+        """
+        if self.accepting:
+            self.selector.unregister(self.server_socket)
+            self.accepting = False
+
+    def receive(self, connection: Connection) -> memoryview | None:
+        """
+        Receives new data from a client that is ready to read into the server's
+        reused buffer, or closes the connection if the client left
+        :param connection: The client's connection
+        :return: The received data, only valid until the next receive(). None if nothing was received
+        """
+        try:
+            nbytes = connection.conn.recv_into(self.recv_view)  # No bytes object per read
+        except (BlockingIOError, InterruptedError):
+            return None  # Readiness was spurious
+        except DISCONNECT_ERRORS:
+            nbytes = 0
+        except OSError as error:  # Like TimeoutError
+            logging.warning("Receiving from %s failed, closing it: %s", connection, error)
+            nbytes = 0
+        if not nbytes:
+            self.close(connection)  # Empty data, client disconnected
+            return None
+
+        self.bytes_in += nbytes
+        connection.last_active = time.monotonic()
+        return self.recv_view[:nbytes]
+
+    def read(self, connection: Connection) -> None:
+        """
+        Appends new data from a client to its recv_buffer, then lets the server handle it
+        :param connection: The client's connection
+        :return: None
+        """
+        data = self.receive(connection)
+        if data is None:
+            return
+        connection.recv_buffer += data
+        self.handle_data(connection)
+        if len(connection.recv_buffer) > MAX_RECV_BUFFERED and not connection.closed:
+            self.close(connection)  # Sends more than the server can handle
+
+    def close(self, connection: Connection) -> None:
+        """
+        Closes a client's socket, unsent data is dropped
+        :param connection: The client's connection
+        :return: None
+        """
+        conn = connection.conn
+        if conn.fileno() == -1:
+            return  # Already closed
+        del self.connections[conn]
+        self.to_flush.discard(connection)
+        self.selector.unregister(conn)
+        conn.close()
+        if len(self.connections) < self.max_connections and self.server_socket.fileno() != -1:
+            self.start_accepting()
+        self.handle_disconnect(connection)
+
+    def watch(self, fileobj, callback: Callable[[], None]) -> None:
+        """
+        Calls a callback whenever a file is readable, like the wake-up socket of a JobRunner
+        :param fileobj: A socket or an object with fileno()
+        :param callback: Called without arguments
+        :return: None
+        """
+        self.watched[fileobj] = callback
+        self.selector.register(fileobj, selectors.EVENT_READ)
+
+    # Loop
+
+    def serve_iteration(self, timeout: float | None) -> float:
+        """
+        Waits up to timeout for ready sockets, handles them, then sends the responses
+        :param timeout: Max seconds to wait, None to wait forever
+        :return: Seconds of work done, without waiting in select()
+        """
+        if self.resume_accepting_at is not None:
+            wait = self.resume_accepting_at - time.monotonic()
+            if wait <= 0:
+                self.start_accepting()
+            elif timeout is None or wait < timeout:
+                timeout = wait
+        ready = self.selector.select(timeout)
+        started = time.perf_counter()
+        for key, mask in ready:
+            connection = key.data
+            if connection is None:
+                if key.fileobj is self.server_socket:
+                    self.accept()  # Add new clients
+                else:
+                    self.watched[key.fileobj]()
+                continue
+
+            try:
+                if mask & selectors.EVENT_WRITE:
+                    self.flush(connection)  # Kernel buffer has room again
+                if mask & selectors.EVENT_READ and not connection.closed:
+                    self.read(connection)
+            except Exception:
+                # A bug or a bad message of one client must not stop the server for everyone
+                logging.exception("Serving %s failed, closing it", connection)
+                self.close(connection)
+
+        self.handle_iteration()
+        self.flush_pending()
+        return time.perf_counter() - started
+
+    def serve_forever(self, timeout: float | None = None) -> None:
+        """
+        Serves clients until interrupted, then shuts down gracefully
+        :param timeout: Max seconds between loop iterations, so handle_iteration() runs even when idle
+        :return: None
+        """
+        self.start_accepting()
+        try:
+            while True:
+                self.serve_iteration(timeout)
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        """
+        Stops accepting clients, sends them what's left for up to SHUTDOWN_TIMEOUT, then closes them
+        :return: None
+        """
+        self.stop_accepting()
+        self.server_socket.close()
+        self.before_flush()
+        self.flush_pending()
+
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for connection in list(self.connections.values()):
+            remaining = deadline - time.monotonic()
+            if not connection.outgoing or remaining <= 0:
+                continue
+            try:
+                connection.conn.settimeout(remaining)  # Blocking, the loop doesn't run anymore
+                for data in connection.outgoing:
+                    connection.conn.sendall(data)
+                    self.bytes_out += len(data)
+            except OSError:
+                pass  # Timed out or disconnected, the rest is dropped
+
+        for connection in list(self.connections.values()):
+            self.close(connection)
+        self.selector.close()
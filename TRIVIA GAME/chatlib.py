@@ -19,7 +19,8 @@ PROTOCOL_CLIENT = {
     "get_score_msg": "MY_SCORE",
     "get_highscore_msg": "HIGHSCORE",
     "get_question_msg": "GET_QUESTION",
-    "send_answer_msg": "SEND_ANSWER"
+    "send_answer_msg": "SEND_ANSWER",
+    "get_metrics_msg": "METRICS"
 }
 
 PROTOCOL_SERVER = {
@@ -31,13 +32,19 @@ PROTOCOL_SERVER = {
     "question_ok_msg": "YOUR_QUESTION",
     "no_questions_msg": "NO_QUESTIONS",
     "correct_answer_msg": "CORRECT_ANSWER",
-    "wrong_answer_msg": "WRONG_ANSWER"
+    "wrong_answer_msg": "WRONG_ANSWER",
+    "metrics_ok_msg": "METRICS_ANSWER"
 }
 
 # Union of all protocol's commands
 ALL_COMMANDS = set(PROTOCOL_CLIENT.values()) | set(PROTOCOL_SERVER.values())
 ERROR_RETURN = None
 
+# Precomputed padded '<cmd>|' headers for the bytes API, and the reverse lookup
+COMMAND_HEADERS = {cmd: f"{cmd.ljust(CMD_FIELD_LENGTH)}{DELIMITER}".encode() for cmd in ALL_COMMANDS}
+HEADER_COMMANDS = {header[:CMD_FIELD_LENGTH]: cmd for cmd, header in COMMAND_HEADERS.items()}
+BYTE_DELIMITER = ord(DELIMITER)
+
 
 def build_message(cmd: str, data: str) -> str | None:
     """
@@ -47,7 +54,7 @@ def build_message(cmd: str, data: str) -> str | None:
     :param data: The data of the message
     :return: Valid protocol message, or None if error occurred
     """
-    data_len = len(data)  # Compute only once
+    data_len = len(data.encode())  # Length field counts bytes on the wire
     # Check length validity of cmd and data fields
     if len(cmd) > CMD_FIELD_LENGTH or data_len > MAX_DATA_LENGTH:
         return ERROR_RETURN
@@ -78,7 +85,7 @@ def parse_message(msg: str) -> tuple[str, str] | tuple[None, None]:
 
     cmd, length, data = msg_parts
     cmd_stripped, length_stripped = cmd.strip(), length.strip()
-    data_len = len(data)  # Compute only once
+    data_len = len(data.encode())  # Length field counts bytes on the wire
 
     # First validate logic, then check lengths
     if cmd_stripped not in ALL_COMMANDS\
@@ -93,6 +100,112 @@ def parse_message(msg: str) -> tuple[str, str] | tuple[None, None]:
     return cmd_stripped, data  # Valid message
 
 
+def build_message_into(buf: bytearray, cmd: str, data: bytes) -> bool:
+    """
+    Bytes version of build_message(): appends a valid protocol message
+    straight to the given buffer, without building intermediate strings.
+    Valid message: <cmd>:(whitespace:16)|<data_len>(zeros:4)|<data>
+    :param buf: The buffer to append the message to
+    :param cmd: The command of the message
+    :param data: The encoded data of the message
+    :return: True if the message was appended, False if fields are too long
+    """
+    header = COMMAND_HEADERS.get(cmd)
+    if header is None:
+        # Not a protocol command, build its header once here
+        if len(cmd) > CMD_FIELD_LENGTH:
+            return False
+        header = f"{cmd.ljust(CMD_FIELD_LENGTH)}{DELIMITER}".encode()
+
+    data_len = len(data)  # Compute only once
+    if data_len > MAX_DATA_LENGTH:
+        return False
+
+    buf += header
+    buf += b"%04d|" % data_len  # Leading zeros until limit, then delimiter
+    buf += data
+    return True
+
+
+def parse_frame(frame: memoryview, commands: dict = HEADER_COMMANDS) -> tuple[str, memoryview] | tuple[None, None]:
+    """
+    Bytes version of parse_message(): parses a single complete message.
+    The header is validated using fixed offsets instead of splitting,
+    and the data field is returned as a view, without copying it.
+    Valid message: <cmd>:(whitespace:16)|<data_len>(whitespace/zeros:4)|<data>
+    :param frame: The whole message (header and data)
+    :param commands: Maps padded command fields to what is returned as cmd, commands not in it are invalid
+    :return: cmd, data fields. If some error occurred, returns None, None
+    """
+    if len(frame) < MSG_HEADER_LENGTH\
+            or frame[CMD_FIELD_LENGTH] != BYTE_DELIMITER\
+            or frame[MSG_HEADER_LENGTH - 1] != BYTE_DELIMITER:
+        return ERROR_RETURN, ERROR_RETURN
+
+    cmd_field = bytes(frame[:CMD_FIELD_LENGTH])
+    cmd = commands.get(cmd_field)
+    if cmd is None:
+        # Slow path, command is not padded to the right
+        cmd = commands.get(cmd_field.strip().ljust(CMD_FIELD_LENGTH))
+        if cmd is None:
+            return ERROR_RETURN, ERROR_RETURN
+
+    length = bytes(frame[CMD_FIELD_LENGTH + 1:MSG_HEADER_LENGTH - 1]).strip()
+    if not length.isdigit() or len(frame) - MSG_HEADER_LENGTH != int(length):
+        return ERROR_RETURN, ERROR_RETURN
+
+    return cmd, frame[MSG_HEADER_LENGTH:]  # Valid message
+
+
+def parse_messages_from_buffer(buffer: bytearray,
+                               commands: dict = HEADER_COMMANDS) -> list[tuple[str, str] | tuple[None, None]]:
+    """
+    Extracts all complete messages from a connection's receive buffer.
+    TCP may split or coalesce messages, so the fixed-size header is used to
+    know exactly where each message ends. Complete messages are removed from
+    the buffer, an incomplete one is left there until the rest of it arrives.
+    If a header is invalid (command, delimiters or length) the stream can't be
+    re-synced, so the buffer is cleared and (None, None) is appended as the last message.
+    A message whose data isn't valid UTF-8 is returned as (None, None) too, but since
+    its header was valid, the messages after it are still parsed
+    :param buffer: The bytes received so far from a single connection
+    :param commands: Maps padded command fields to what is returned as cmd, see parse_frame()
+    :return: cmd, data of every complete message (may be an empty list)
+    """
+    messages = []
+    offset = 0
+    buffer_len = len(buffer)  # Compute only once
+
+    with memoryview(buffer) as view:
+        while buffer_len - offset >= MSG_HEADER_LENGTH:
+            length = bytes(view[offset + CMD_FIELD_LENGTH + 1:offset + MSG_HEADER_LENGTH - 1]).strip()
+            if not length.isdigit():
+                messages.append((ERROR_RETURN, ERROR_RETURN))
+                offset = buffer_len  # Drop the rest of the stream
+                break
+
+            msg_end = offset + MSG_HEADER_LENGTH + int(length)
+            if msg_end > buffer_len:
+                break  # Message is not complete yet
+
+            with view[offset:msg_end] as frame:
+                cmd, data = parse_frame(frame, commands)
+                if cmd is ERROR_RETURN:
+                    messages.append((ERROR_RETURN, ERROR_RETURN))
+                    offset = buffer_len  # Drop the rest of the stream
+                    break
+                with data:
+                    try:
+                        data = str(data, "utf-8")
+                    except UnicodeDecodeError:
+                        cmd, data = ERROR_RETURN, ERROR_RETURN
+            messages.append((cmd, data))
+            offset = msg_end
+
+    del buffer[:offset]  # Keep only the incomplete tail
+    return messages
+
+
 def split_data(msg: str, expected_fields: int) -> list[str] | list[None]:
     """
     Helper method. Gets a string and number of expected fields in it.
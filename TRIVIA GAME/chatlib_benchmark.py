@@ -0,0 +1,51 @@
+# Microbenchmarks of chatlib's build & parse functions, run before and after protocol changes
+import timeit
+import chatlib
+
+REPEATS = 5
+STREAM_MESSAGES = 100  # Messages in the buffer parsed by parse_messages_from_buffer()
+
+
+def bench(name, statement, number=100_000):
+    """
+    Times a statement, then prints the best time per call
+    :param name: What is measured
+    :param statement: A callable that runs it once
+    :param number: Num of calls per repeat
+    :return: None
+    """
+    best = min(timeit.repeat(statement, number=number, repeat=REPEATS))
+    print(f"{name:<40}{best / number * 1e9:>10.0f} ns/call")
+
+
+def main():
+    data = "0a94fa35#Which of these is a programming language?#Python#Cobra#Viper#Mamba"
+    encoded_data = data.encode()
+    message = chatlib.build_message("YOUR_QUESTION", data)
+    frame = memoryview(message.encode())
+
+    # STRINGS
+    bench("build_message", lambda: chatlib.build_message("YOUR_QUESTION", data))
+    bench("parse_message", lambda: chatlib.parse_message(message))
+    bench("split_data", lambda: chatlib.split_data(data, 6))
+    bench("join_data", lambda: chatlib.join_data(["test", "test"]))
+
+    # BYTES
+    def build_into():
+        chatlib.build_message_into(bytearray(), "YOUR_QUESTION", encoded_data)
+
+    bench("build_message_into", build_into)
+    bench("parse_frame", lambda: chatlib.parse_frame(frame))
+
+    stream = message.encode() * STREAM_MESSAGES
+
+    def parse_stream():
+        chatlib.parse_messages_from_buffer(bytearray(stream))
+
+    number = 1000
+    best = min(timeit.repeat(parse_stream, number=number, repeat=REPEATS))
+    print(f"{'parse_messages_from_buffer':<40}{best / number / STREAM_MESSAGES * 1e9:>10.0f} ns/message")
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,54 @@ def check_parse(msg_str, expected_output):
         print(".....\t FAILED, output: ", output)
 
 
+def check_build_into(input_cmd, input_data, expected_output):
+    print("Input: ", input_cmd, input_data,
+          "\nExpected output: ", expected_output)
+    try:
+        buf = bytearray()
+        output = bytes(buf) if chatlib.build_message_into(buf, input_cmd, input_data) else None
+    except Exception as e:
+        output = "Exception raised: " + str(e)
+
+    if output == expected_output:
+        print(".....\t SUCCESS")
+    else:
+        print(".....\t FAILED, output: ", output)
+
+
+def check_frame(frame, expected_output, commands=chatlib.HEADER_COMMANDS):
+    print("Input: ", frame, "\nExpected output: ", expected_output)
+
+    try:
+        cmd, data = chatlib.parse_frame(memoryview(frame), commands)
+        output = (cmd, data if data is None else bytes(data))
+    except Exception as e:
+        output = "Exception raised: " + str(e)
+
+    if output == expected_output:
+        print(".....\t SUCCESS")
+    else:
+        print(".....\t FAILED, output: ", output)
+
+
+def check_stream(chunks, expected_output):
+    print("Input: ", chunks, "\nExpected output: ", expected_output)
+
+    try:
+        buffer = bytearray()
+        output = []
+        for chunk in chunks:
+            buffer += chunk
+            output += chatlib.parse_messages_from_buffer(buffer)
+    except Exception as e:
+        output = "Exception raised: " + str(e)
+
+    if output == expected_output:
+        print(".....\t SUCCESS")
+    else:
+        print(".....\t FAILED, output: ", output)
+
+
 def main():
     # BUILD
 
@@ -66,6 +114,47 @@ def main():
     check_parse("LOGIN           |	  z|data", (None, None))
     check_parse("LOGIN           |	  5|data", (None, None))
 
+    check_parse("LOGIN           |0002|\u00e9", ("LOGIN", "\u00e9"))  # Length in bytes
+
+    # BYTES
+
+    # Valid inputs
+    check_build_into("LOGIN", b"aaaa#bbbb", b"LOGIN           |0009|aaaa#bbbb")
+    check_build_into("LOGIN", b"", b"LOGIN           |0000|")
+    check_build_into("NOT_A_COMMAND", b"data", b"NOT_A_COMMAND   |0004|data")
+    check_frame(b"LOGIN           |0009|aaaa#bbbb", ("LOGIN", b"aaaa#bbbb"))
+    check_frame(b"           LOGIN|   9|aaaa#bbbb", ("LOGIN", b"aaaa#bbbb"))
+    check_frame(b"LOGIN           |9   |aaaa#bbbb", ("LOGIN", b"aaaa#bbbb"))
+    check_frame(b" LOGIN          |0004|data", (1, b"data"), {b"LOGIN".ljust(16): 1})  # Custom mapping
+
+    # Invalid inputs
+    check_build_into("0123456789ABCDEFG", b"", None)
+    check_build_into("A", b"A" * (chatlib.MAX_DATA_LENGTH + 1), None)
+    check_frame(b"", (None, None))
+    check_frame(b"LOGIN           x   4|data", (None, None))
+    check_frame(b"LOGOUT          |0000|", (None, None), {b"LOGIN".ljust(16): 1})
+    check_frame(b"LOGIN           |   5|data", (None, None))
+    check_frame(b"NOPE            |   4|data", (None, None))
+
+    # STREAM
+
+    # Valid inputs
+    # Coalesced messages
+    check_stream([b"LOGIN           |0004|dataLOGOUT          |0000|"], [("LOGIN", "data"), ("LOGOUT", "")])
+    # Split message
+    check_stream([b"LOGIN      ", b"     |00", b"04|da", b"ta"], [("LOGIN", "data")])
+    # Incomplete message
+    check_stream([b"LOGIN           |0004|dat"], [])
+
+    # Invalid inputs
+    check_stream([b"LOGIN           |00x4|dataLOGOUT          |0000|"], [(None, None)])
+    check_stream([b"NOPE            |0000|"], [(None, None)])
+    # What follows an invalid command or delimiter may be out of sync, so it's dropped
+    check_stream([b"NOPE            |0000|LOGOUT          |0000|"], [(None, None)])
+    check_stream([b"LOGIN           #0004|dataLOGOUT          |0000|"], [(None, None)])
+    # Invalid data in a valid frame, the next message is still in sync
+    check_stream([b"LOGIN           |0001|\xffLOGOUT          |0000|"], [(None, None), ("LOGOUT", "")])
+
 
 if __name__ == '__main__':
     main()
@@ -1,4 +1,5 @@
 import socket
+from collections import deque
 import chatlib
 
 SERVER_IP = "loopback"  # CHANGE TO SERVER'S IP
@@ -6,6 +7,9 @@ SERVER_PORT = 5678
 BUFFER_SIZE = 1024
 IS_DEBUG = False  # Print debug info in functions
 
+recv_buffer = bytearray()  # Received bytes that are not a full message yet
+received_messages = deque()  # Parsed messages that were not handled yet
+
 
 def build_and_send_message(conn: socket.socket, code: str, data: str) -> None:
     """
@@ -24,17 +28,22 @@ def build_and_send_message(conn: socket.socket, code: str, data: str) -> None:
 
 def recv_msg_and_parse(conn: socket.socket) -> tuple[str, str] | tuple[None, None]:
     """
-    Receives a new message from given socket, prints debug info,
-    then parses the message using chatlib
+    Receives from given socket until a full message arrives, prints debug info,
+    then parses the message using chatlib. Extra messages are kept for next calls
     :param conn: The socket connection
     :return: cmd and data of received message, (None, None) if error occurred
     """
-    full_msg = conn.recv(BUFFER_SIZE).decode()  # Get server response
+    while not received_messages:
+        chunk = conn.recv(BUFFER_SIZE)  # Get server response
+        if not chunk:
+            return None, None  # Server closed the connection
 
-    if IS_DEBUG:
-        print(f"Received: {full_msg}")
-    cmd, data = chatlib.parse_message(full_msg)
-    return cmd, data
+        if IS_DEBUG:
+            print(f"Received: {chunk}")
+        recv_buffer.extend(chunk)
+        received_messages.extend(chatlib.parse_messages_from_buffer(recv_buffer))
+
+    return received_messages.popleft()
 
 
 def build_send_recv_parse(conn: socket.socket, cmd: str, data: str) -> tuple[str, str] | tuple[None, None]:
@@ -0,0 +1,188 @@
+"""
+Shared state of a multi-worker trivia server. A coordinator process owns the real storage
+and the logged-in usernames, workers reach it through a manager over a Unix socket
+"""
+import threading
+from collections import Counter
+from multiprocessing.managers import BaseManager
+from typing import Callable
+from storage import Storage
+
+shared_state = None  # The SharedState, only set in the coordinator process
+
+
+class SharedState:
+    """
+    Lives in the coordinator process. The manager serves every worker in its own thread,
+    so all calls are serialized with a lock
+    """
+
+    def __init__(self, storage: Storage):
+        """
+        :param storage: The loaded storage all workers share
+        """
+        self.storage = storage
+        self.logged_users = Counter()  # A user may be logged-in from some sockets
+        self.lock = threading.Lock()
+
+    def call(self, method_name: str, *args):
+        """
+        Calls a method of the shared storage
+        :param method_name: Name of the Storage method
+        :param args: The method's arguments
+        :return: Whatever the method returns
+        """
+        with self.lock:
+            return getattr(self.storage, method_name)(*args)
+
+    def add_logged_user(self, username: str) -> None:
+        """
+        :param username: The user that logged-in
+        :return: None
+        """
+        with self.lock:
+            self.logged_users[username] += 1
+
+    def remove_logged_user(self, username: str) -> None:
+        """
+        :param username: The user that logged-out
+        :return: None
+        """
+        with self.lock:
+            self.logged_users[username] -= 1
+            if self.logged_users[username] <= 0:
+                del self.logged_users[username]
+
+    def logged_usernames(self) -> list[str]:
+        """
+        :return: Usernames logged-in to any worker, once per socket
+        """
+        with self.lock:
+            return list(self.logged_users.elements())
+
+
+class CoordinatorManager(BaseManager):
+    """
+    Serves the SharedState to the workers
+    """
+
+
+def init_shared_state(storage_factory: Callable[[], Storage]) -> None:
+    """
+    Runs in the coordinator process when it starts, creates the shared storage there
+    :param storage_factory: Creates and loads the storage
+    :return: None
+    """
+    global shared_state
+    shared_state = SharedState(storage_factory())
+
+
+def get_shared_state() -> SharedState:
+    """
+    :return: The coordinator's SharedState
+    """
+    return shared_state
+
+
+CoordinatorManager.register("get_shared_state", callable=get_shared_state)
+
+
+def start_coordinator(storage_factory: Callable[[], Storage]) -> CoordinatorManager:
+    """
+    Starts the coordinator process, listening on a temporary Unix socket
+    :param storage_factory: Creates and loads the storage, called in the coordinator
+    :return: The started manager, child processes connect to its address
+    """
+    manager = CoordinatorManager()
+    manager.start(initializer=init_shared_state, initargs=(storage_factory,))
+    return manager
+
+
+def connect_to_coordinator(address):
+    """
+    Connects to a coordinator started by this process or its parent,
+    they share the authkey of the coordinator's manager
+    :param address: Address of the coordinator's manager
+    :return: A proxy of the coordinator's SharedState
+    """
+    manager = CoordinatorManager(address=address)
+    manager.connect()
+    return manager.get_shared_state()
+
+
+class RemoteStorage(Storage):
+    """
+    A worker's storage, forwards every call to the coordinator.
+    The coordinator loads, maintains and closes the real storage
+    """
+
+    def __init__(self, state, score_version=None):
+        """
+        :param state: Proxy of the coordinator's SharedState
+        :param score_version: A multiprocessing.Value shared by all workers, bumped
+        whenever a score changes, so workers can cache scores without asking the coordinator
+        """
+        self.state = state
+        self.shared_score_version = score_version
+        self.uncommitted = False  # Answers were recorded since the last commit()
+        self.questions = {}  # Questions already fetched or set by this worker
+
+    def load(self) -> None:
+        pass  # Already loaded by the coordinator
+
+    def get_password(self, username: str) -> str | None:
+        return self.state.call("get_password", username)
+
+    def get_score(self, username: str) -> int:
+        return self.state.call("get_score", username)
+
+    def get_questions_asked(self, username: str) -> set[str]:
+        return self.state.call("get_questions_asked", username)
+
+    def record_answer(self, username: str, question_id: str, points: int) -> None:
+        self.state.call("record_answer", username, question_id, points)
+        self.uncommitted = True
+        if points and self.shared_score_version is not None:
+            with self.shared_score_version.get_lock():
+                self.shared_score_version.value += 1  # After the coordinator has the new score
+
+    def score_version(self) -> int:
+        """
+        Read from shared memory, no call to the coordinator. Read it before reading
+        scores: a score changed after that bumps it, so the scores are read again later
+        :return: A number that changes whenever any worker changes a score
+        """
+        return self.shared_score_version.value
+
+    def top_scores(self, count: int) -> list[tuple[str, int]]:
+        return self.state.call("top_scores", count)
+
+    def set_questions(self, questions: dict[str, dict]) -> None:
+        """
+        Every worker refreshes the questions through its own RemoteStorage, so updating
+        the cache here keeps it in line with the worker's built question messages
+        """
+        self.state.call("set_questions", questions)
+        self.questions.update(questions)  # Replaced questions too
+
+    def get_question(self, question_id: str) -> dict | None:
+        question = self.questions.get(question_id)
+        if question is None:
+            question = self.state.call("get_question", question_id)
+            if question is not None:
+                self.questions[question_id] = question
+        return question
+
+    def question_ids(self) -> list[str]:
+        return self.state.call("question_ids")
+
+    def commit(self) -> None:
+        """
+        Called every loop iteration, so the coordinator is only called if answers were recorded
+        """
+        if self.uncommitted:
+            self.state.call("commit")
+            self.uncommitted = False
+
+    def close(self) -> None:
+        self.commit()  # Closed by the coordinator
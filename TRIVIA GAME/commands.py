@@ -0,0 +1,69 @@
+"""
+Registry of the commands a server handles. Handlers are looked up by the raw
+padded command field of a message, so dispatching needs no string work
+"""
+import time
+from typing import Callable
+import chatlib
+from metrics import Histogram
+
+
+class Command:
+    """
+    A registered command, its handler and its stats
+    """
+    __slots__ = ("name", "handler", "login_required", "latency")
+
+    def __init__(self, name: str, handler: Callable, login_required: bool):
+        """
+        :param name: The command, as sent by clients
+        :param handler: Called with the client's session and the message's data
+        :param login_required: Only logged-in clients may send the command
+        """
+        self.name = name
+        self.handler = handler
+        self.login_required = login_required
+        self.latency = Histogram()  # Handler calls, also counts the handled messages
+
+    def __call__(self, session, data: str) -> None:
+        """
+        Calls the handler, counting and timing the call
+        :param session: The client's session
+        :param data: The data of the message
+        :return: None
+        """
+        start = time.perf_counter()
+        self.handler(session, data)
+        self.latency.record(time.perf_counter() - start)
+
+
+class CommandRegistry:
+    """
+    Maps padded command fields to Commands. Pass headers to
+    chatlib.parse_messages_from_buffer() to get Commands instead of names
+    """
+
+    def __init__(self):
+        self.headers = {}  # Padded command field (bytes) to its Command
+
+    def register(self, *names: str, login_required: bool = True) -> Callable:
+        """
+        Decorator, registers a handler for the given commands
+        :param names: The commands the handler handles
+        :param login_required: Only logged-in clients may send the commands
+        :return: The decorator, it returns the handler unchanged
+        """
+        def decorator(handler: Callable) -> Callable:
+            for name in names:
+                if len(name) > chatlib.CMD_FIELD_LENGTH:
+                    raise ValueError(f"Command {name} is longer than {chatlib.CMD_FIELD_LENGTH} chars")
+                self.headers[name.ljust(chatlib.CMD_FIELD_LENGTH).encode()] = Command(name, handler, login_required)
+            return handler
+        return decorator
+
+    def stats(self) -> dict[str, dict]:
+        """
+        :return: Count and latency histogram of every command that was handled, see Histogram.to_dict()
+        """
+        return {command.name: command.latency.to_dict()
+                for command in self.headers.values() if command.latency.count}
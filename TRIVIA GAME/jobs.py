@@ -0,0 +1,130 @@
+"""
+Runs blocking work away from the server loop: a thread pool for I/O and a process pool
+for CPU-heavy work. Results are handed back to the loop thread through a wake-up socket
+"""
+import logging
+import multiprocessing
+import select
+import socket
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+
+class JobRunner:
+    """
+    Submits jobs to worker pools. When a job is done, its callback is queued and the
+    wake-up socket becomes readable, the loop then calls run_callbacks() to apply the results
+    """
+
+    def __init__(self, io_threads: int = 4, cpu_processes: int = 1):
+        """
+        :param io_threads: Num of threads for blocking I/O
+        :param cpu_processes: Num of processes for CPU-heavy work, created on first use
+        """
+        self.io_pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="io")
+        self.cpu_processes = cpu_processes
+        self.cpu_pool = None
+        self.done = deque()  # (callback, on_error, future) of finished jobs, appended from pool threads
+        self.pending = set()  # Futures of the jobs whose callbacks didn't run yet
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+
+    def fileno(self) -> int:
+        """
+        Lets the selector watch the wake-up socket
+        :return: The wake-up socket's file descriptor
+        """
+        return self.wakeup_reader.fileno()
+
+    def run_io(self, func: Callable, *args, callback: Callable = None, on_error: Callable = None) -> Future:
+        """
+        Runs a blocking I/O job in the thread pool
+        :param func: The job
+        :param args: The job's arguments
+        :param callback: Called on the loop thread with the job's result
+        :param on_error: Called on the loop thread with the job's exception if it failed
+        :return: The job's future
+        """
+        return self.watch(self.io_pool.submit(func, *args), callback, on_error)
+
+    def run_cpu(self, func: Callable, *args, callback: Callable = None, on_error: Callable = None) -> Future:
+        """
+        Runs a CPU-heavy job in the process pool. The job and its arguments
+        are pickled, so they must not be changed by the loop meanwhile
+        :param func: The job, must be a module-level function
+        :param args: The job's arguments
+        :param callback: Called on the loop thread with the job's result
+        :param on_error: Called on the loop thread with the job's exception if it failed
+        :return: The job's future
+        """
+        if self.cpu_pool is None:
+            # Not forked from the loop, a forked child would hold copies of the clients' sockets
+            # and keep them open after the server closes them
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self.cpu_pool = ProcessPoolExecutor(max_workers=self.cpu_processes,
+                                                mp_context=multiprocessing.get_context(start_method))
+        return self.watch(self.cpu_pool.submit(func, *args), callback, on_error)
+
+    def watch(self, future: Future, callback: Callable | None, on_error: Callable | None) -> Future:
+        """
+        Queues the callbacks once the future is done and wakes the loop up
+        :param future: The job's future
+        :param callback: Called on the loop thread with the job's result
+        :param on_error: Called on the loop thread with the job's exception if it failed
+        :return: The job's future
+        """
+        def on_done(done_future: Future) -> None:
+            self.done.append((callback, on_error, done_future))
+            try:
+                self.wakeup_writer.send(b"\0")
+            except BlockingIOError:
+                pass  # The loop is already woken up
+
+        self.pending.add(future)
+        future.add_done_callback(on_done)
+        return future
+
+    def run_callbacks(self) -> None:
+        """
+        Called on the loop thread when the wake-up socket is readable,
+        applies the results of all finished jobs. Failed jobs, and callbacks that
+        raised, are logged and passed to their on_error callback
+        :return: None
+        """
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.done:
+            callback, on_error, future = self.done.popleft()
+            self.pending.discard(future)
+            try:
+                result = future.result()
+                if callback is not None:
+                    callback(result)
+            except Exception as error:
+                logging.exception("Background job failed")
+                if on_error is not None:
+                    try:
+                        on_error(error)
+                    except Exception:
+                        logging.exception("Handling a failed background job failed")
+
+    def shutdown(self) -> None:
+        """
+        Waits for all jobs and applies their results, including jobs submitted
+        by those results (like a fetch followed by a build), then stops the pools
+        :return: None
+        """
+        while self.pending:
+            select.select([self.wakeup_reader], [], [])  # Woken up after a job's callbacks were queued
+            self.run_callbacks()
+        if self.cpu_pool is not None:
+            self.cpu_pool.shutdown(wait=True)
+        self.io_pool.shutdown(wait=True)
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
@@ -0,0 +1,62 @@
+"""
+A top-N index of user scores, kept up to date as scores change
+"""
+import heapq
+
+
+class Leaderboard:
+    """
+    A heap of (-score, username) pairs, so the highest score is always first.
+    A score change pushes a new pair, O(log n), and leaves the old one in the heap.
+    Old pairs are dropped when top() reaches them, and the heap is rebuilt
+    once most of it is old pairs, so updates stay O(log n) amortized
+    """
+
+    def __init__(self, scores: dict[str, int] = None):
+        """
+        :param scores: Initial dict of usernames and their scores
+        """
+        self.scores = dict(scores or {})
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """
+        Builds the heap from the current scores only, O(n)
+        :return: None
+        """
+        self.entries = [(-score, username) for username, score in self.scores.items()]
+        heapq.heapify(self.entries)
+
+    def update(self, username: str, score: int) -> None:
+        """
+        Sets the score of a user, adding the user if needed
+        :param username: The user to update
+        :param score: The user's new score
+        :return: None
+        """
+        if self.scores.get(username) == score:
+            return
+
+        self.scores[username] = score
+        heapq.heappush(self.entries, (-score, username))
+        if len(self.entries) > 2 * len(self.scores) + 64:
+            self.rebuild()  # Mostly old pairs
+
+    def top(self, count: int) -> list[tuple[str, int]]:
+        """
+        Pops the first count current pairs, dropping old pairs on the way, then pushes them back.
+        O(count log n), plus O(log n) per old pair, which is dropped for good
+        :param count: Num of users to return
+        :return: (username, score) of the users with the highest scores, highest first
+        """
+        entries, scores = self.entries, self.scores
+        best = []
+        while entries and len(best) < count:
+            entry = heapq.heappop(entries)
+            score, username = entry
+            if scores.get(username) == -score and (not best or entry != best[-1]):
+                best.append(entry)  # Current, and not a duplicate of a score that came back
+
+        for entry in best:
+            heapq.heappush(entries, entry)
+        return [(username, -score) for score, username in best]
@@ -0,0 +1,76 @@
+"""
+Low-overhead counters and latency histograms of the trivia server
+"""
+import time
+
+HISTOGRAM_BUCKETS = 32  # Bucket i counts durations below 2**i microseconds, the last one counts the rest
+
+
+class Histogram:
+    """
+    Latency histogram with power-of-2 microsecond buckets,
+    recording a duration is a few integer operations
+    """
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0  # Seconds
+        self.max = 0.0  # Seconds
+
+    def record(self, seconds: float) -> None:
+        """
+        :param seconds: The measured duration
+        :return: None
+        """
+        self.buckets[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> int:
+        """
+        :param fraction: Between 0 and 1, like 0.99
+        :return: Upper bound (in microseconds) of the bucket the percentile falls in, 0 if empty
+        """
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if bucket and seen >= rank:
+                return 2 ** index
+        return 0
+
+    def to_dict(self) -> dict:
+        """
+        :return: Count, average, percentiles and max in microseconds, and the non-empty buckets
+        keyed by their upper bound
+        """
+        return {"count": self.count,
+                "avg_us": round(self.total / self.count * 1e6, 1) if self.count else 0,
+                "p50_us": self.percentile(0.5),
+                "p99_us": self.percentile(0.99),
+                "max_us": round(self.max * 1e6, 1),
+                "buckets": {2 ** index: bucket for index, bucket in enumerate(self.buckets) if bucket}}
+
+
+class ServerMetrics:
+    """
+    Server-wide timings, updated by the loop. Bytes are counted by the server core
+    """
+    __slots__ = ("started", "loop_time", "commit_time")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.loop_time = Histogram()  # Work done per loop iteration, without waiting in select()
+        self.commit_time = Histogram()  # storage.commit() calls
+
+    def to_dict(self) -> dict:
+        """
+        :return: All metrics, ready to be sent as JSON
+        """
+        return {"uptime": round(time.monotonic() - self.started, 1),
+                "loop_time": self.loop_time.to_dict(),
+                "commit_time": self.commit_time.to_dict()}
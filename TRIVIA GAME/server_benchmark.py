@@ -0,0 +1,242 @@
+"""
+Load test of the trivia server: starts server_trivia on localhost with a generated
+database, then runs many asyncio clients that log in and loop over
+GET_QUESTION -> SEND_ANSWER -> HIGHSCORE. Reports throughput, latency and memory
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import chatlib
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+SERVER_IP = "127.0.0.1"
+SERVER_PORT = 5679  # Not the real server's port
+NUM_CLIENTS = 1000
+ROUNDS = 20  # GET_QUESTION -> SEND_ANSWER -> HIGHSCORE loops per client
+NUM_QUESTIONS = 500
+CORRECT_SHARE = 0.5  # Share of questions answered right, each one changes a score and the highscore table
+ADMIN = "master"  # Made the server's only admin, gets the server's metrics at the end
+STARTUP_TIMEOUT = 10
+
+
+def create_fixture_database(directory: str) -> dict[str, str]:
+    """
+    Writes a users file and a questions file with generated data
+    :param directory: Where to write the files
+    :return: Paths of the files, by server_trivia setting name
+    """
+    users = {f"user{index}": {"password": "pass", "score": 0, "questions_asked": []}
+             for index in range(NUM_CLIENTS)}
+    users[ADMIN] = {"password": ADMIN, "score": 0, "questions_asked": []}
+
+    questions = {}
+    for index in range(NUM_QUESTIONS):
+        question = f"Benchmark question number {index}?"
+        question_id = hashlib.md5(question.encode()).hexdigest()[:8]
+        questions[question_id] = {"question": question, "correct_answer": f"right {index}",
+                                  "incorrect_answers": [f"wrong {index}.{wrong}" for wrong in range(3)]}
+
+    paths = {"USERS_FILE_PATH": os.path.join(directory, "users.json"),
+             "USERS_JOURNAL_PATH": os.path.join(directory, "users_journal.jsonl"),
+             "QUESTIONS_FILE_PATH": os.path.join(directory, "questions.json"),
+             "SQLITE_DB_PATH": os.path.join(directory, "trivia.db")}
+    with open(paths["USERS_FILE_PATH"], 'w') as file:
+        json.dump(users, file)
+    with open(paths["QUESTIONS_FILE_PATH"], 'w') as file:
+        json.dump(questions, file)
+    return paths
+
+
+def raise_open_files_limit() -> None:
+    """
+    Every client needs a socket, on both sides
+    :return: None
+    """
+    if resource is not None:
+        _soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run_server(settings: dict) -> None:
+    """
+    Runs in the server process: overrides server_trivia's settings, then starts it
+    :param settings: Names and values of server_trivia's settings
+    :return: None
+    """
+    raise_open_files_limit()
+    import server_trivia
+    for name, value in settings.items():
+        setattr(server_trivia, name, value)
+    server_trivia.main()
+
+
+class Client:
+    """
+    A simulated player, waits for every response before sending the next request
+    """
+
+    def __init__(self, username: str, password: str, latencies: list[float]):
+        """
+        :param username: The user to log in as
+        :param password: The user's password
+        :param latencies: Every request's latency (seconds) is appended to it
+        """
+        self.username = username
+        self.password = password
+        self.latencies = latencies
+        self.reader = None
+        self.writer = None
+        self.buffer = bytearray()
+        self.responses = []
+
+    async def request(self, cmd: str, data: str = "") -> tuple[str, str]:
+        """
+        Sends a request and waits for its response
+        :param cmd: The command of the request
+        :param data: The data of the request
+        :return: cmd, data of the response
+        """
+        start = time.perf_counter()
+        self.writer.write(chatlib.build_message(cmd, data).encode())
+        while not self.responses:
+            chunk = await self.reader.read(4096)
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            self.buffer += chunk
+            self.responses += chatlib.parse_messages_from_buffer(self.buffer)
+        self.latencies.append(time.perf_counter() - start)
+        return self.responses.pop(0)
+
+    async def play(self, rounds: int) -> None:
+        """
+        Logs in, then answers questions and checks the highscore table
+        :param rounds: Num of question loops
+        :return: None
+        """
+        self.reader, self.writer = await asyncio.open_connection(SERVER_IP, SERVER_PORT)
+        cmd, data = await self.request("LOGIN", f"{self.username}#{self.password}")
+        if cmd != "LOGIN_OK":
+            raise ValueError(f"Login of {self.username} failed: {data}")
+
+        for _ in range(rounds):
+            cmd, data = await self.request("GET_QUESTION")
+            if cmd == "YOUR_QUESTION":
+                question_id, _question, *answers = chatlib.split_data(data, 6)
+                if random.random() < CORRECT_SHARE:
+                    answer = next(answer for answer in answers if answer.startswith("right "))
+                else:
+                    answer = "no idea"
+                await self.request("SEND_ANSWER", f"{question_id}#{answer}")
+            await self.request("HIGHSCORE")
+
+        self.writer.write(chatlib.build_message("LOGOUT", "").encode())  # No response, the server just closes
+        self.writer.close()
+
+
+async def connect_when_up() -> None:
+    """
+    Waits until the server accepts connections
+    :return: None
+    """
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            _reader, writer = await asyncio.open_connection(SERVER_IP, SERVER_PORT)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run_load(num_clients: int, rounds: int) -> tuple[list[float], float, dict]:
+    """
+    Runs all clients at once
+    :param num_clients: Num of simulated clients
+    :param rounds: Num of question loops per client
+    :return: Latencies of all requests, elapsed seconds, and the server's metrics
+    """
+    await connect_when_up()
+    latencies = []
+    clients = [Client(f"user{index}", "pass", latencies) for index in range(num_clients)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client.play(rounds) for client in clients))
+    elapsed = time.perf_counter() - start
+
+    admin = Client(ADMIN, ADMIN, [])
+    admin.reader, admin.writer = await asyncio.open_connection(SERVER_IP, SERVER_PORT)
+    await admin.request("LOGIN", f"{ADMIN}#{ADMIN}")
+    cmd, data = await admin.request("METRICS")
+    admin.writer.close()
+    return latencies, elapsed, json.loads(data) if cmd == "METRICS_ANSWER" else {}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """
+    :param sorted_values: Sorted measurements
+    :param fraction: Between 0 and 1, like 0.99
+    :return: The measurement at that rank
+    """
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def print_report(latencies: list[float], elapsed: float, server_metrics: dict, server_rss_kb: int | None) -> None:
+    """
+    Prints the benchmark's results
+    :return: None
+    """
+    latencies.sort()
+    print(f"Clients: {NUM_CLIENTS}, rounds: {ROUNDS}, requests: {len(latencies)}")
+    print(f"Throughput: {len(latencies) / elapsed:.0f} requests/s ({elapsed:.2f}s)")
+    print(f"Latency: p50 {percentile(latencies, 0.5) * 1e3:.2f}ms, "
+          f"p99 {percentile(latencies, 0.99) * 1e3:.2f}ms, max {latencies[-1] * 1e3:.2f}ms")
+    if server_metrics:
+        loop_time = server_metrics["loop_time"]
+        print(f"Server loop: {loop_time['count']} iterations, {loop_time['avg_us']}us avg, "
+              f"{loop_time['p99_us']}us p99")
+        for name, stats in server_metrics["commands"].items():
+            print(f"\t{name:<14}{stats['count']:>8} messages, {stats['avg_us']:>8}us avg, {stats['p99_us']:>6}us p99")
+    if server_rss_kb is not None:
+        print(f"Server peak memory: {server_rss_kb / 1024:.1f} MB")
+    if resource is not None:
+        print(f"Load generator peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+def main():
+    raise_open_files_limit()
+    with tempfile.TemporaryDirectory() as directory:
+        settings = create_fixture_database(directory)
+        settings.update({"SERVER_IP": SERVER_IP, "SERVER_PORT": SERVER_PORT, "QUESTIONS_SOURCE": "file",
+                         "LOG_LEVEL": logging.WARNING, "ADMIN_USERS": {ADMIN}})
+        server = multiprocessing.Process(target=run_server, args=(settings,), name="server")
+        server.start()
+        try:
+            latencies, elapsed, server_metrics = asyncio.run(run_load(NUM_CLIENTS, ROUNDS))
+        finally:
+            server.terminate()
+            server.join()
+
+    # ru_maxrss is in KB on Linux, the server is the biggest child
+    server_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss if resource is not None else None
+    print_report(latencies, elapsed, server_metrics, server_rss_kb)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        NUM_CLIENTS = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        ROUNDS = int(sys.argv[2])
+    main()
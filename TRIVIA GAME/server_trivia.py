@@ -2,83 +2,139 @@
 The interactive server of the trivia game, protocol in network.py course
 """
 import logging
+import signal
 import socket
-import select
 import random
 import hashlib  # To create unique question IDs
 import json
 import html  # To remove HTML codes
+import itertools
+import time
+import multiprocessing
+from multiprocessing.connection import wait
 import requests
 import chatlib
-
-users = {}
-questions = {}
-logged_users = {}  # Contains tuples of sockets and usernames
-client_sockets = set()
-messages_to_send = []
+import cluster
+from commands import Command, CommandRegistry
+from jobs import JobRunner
+from metrics import ServerMetrics
+from session import Session
+from storage import Storage, JsonStorage, SqliteStorage
+from tcp_core import tcp_server
+
+storage: Storage | None = None  # Users and questions, see create_storage()
+jobs: JobRunner | None = None  # Runs blocking work off the loop, see serve()
+shared_state = None  # Proxy of the coordinator's state, only in multi-worker mode
+server: "TriviaServer | None" = None  # Its connections are the sessions, see serve()
+commands = CommandRegistry()  # Handlers of client commands, see handle_client_message()
+metrics = ServerMetrics()  # Bytes, loop and storage timings, commands are timed by their registry
+question_messages = {}  # Built YOUR_QUESTION messages of each question, for every order of its answers
+remaining_questions = {}  # IDs of the questions each logged-in user was not asked yet
+user_sessions = {}  # Num of open sessions of each logged-in user
+highscore_message = None  # Built HIGHSCORE response, until a score changes
+highscore_version = None  # Score version of the coordinator when highscore_message was built, multi-worker only
+next_questions_refresh = None  # Monotonic time of the next background questions refresh, None while one runs
 
 SERVER_IP = "0.0.0.0"
 SERVER_PORT = 5678
-BUFFER_SIZE = 1024
+NUM_WORKERS = 1  # Processes that accept clients on SERVER_PORT, more than 1 needs SO_REUSEPORT
+MAX_CLIENTS = tcp_server.MAX_CONNECTIONS  # Per worker, new clients wait in the listen backlog
+CORK_RESPONSES = True  # Hold responses until the end of the loop iteration, then send them together
+FLUSH_THRESHOLD = 64 * 1024  # Send right away once a socket has this many bytes queued
 
 USERS_FILE_PATH = r"server database\users.json"
+USERS_JOURNAL_PATH = r"server database\users_journal.jsonl"
 QUESTIONS_FILE_PATH = r"server database\questions.json"
+SQLITE_DB_PATH = r"server database\trivia.db"
+STORAGE_BACKEND = "json"  # "json" or "sqlite"
+QUESTIONS_SOURCE = "web"  # "web" or "file"
+QUESTIONS_REFRESH_INTERVAL = 60 * 60  # Seconds between background loads of new questions
 QUESTIONS_API_URL = "https://opentdb.com/api.php"
 # Category 18 is computer science
 QUESTIONS_SETTINGS = {"amount": "50", "type": "multiple", "category": "18"}
 ERROR_MSG = "ERROR"
 POINTS_PER_QUESTION = 5
+HIGHSCORE_TABLE_SIZE = 5
+STORAGE_MAINTAIN_INTERVAL = 60  # Max seconds between storage housekeeping, like journal compaction
+LOG_LEVEL = logging.DEBUG  # logging.INFO skips the per-message logs, which slow the server down
+ADMIN_USERS = set()  # Users that may get the server's metrics, none by default since the bundled users are public
 
 
 # HELPER SOCKET METHODS
 
 
-def build_and_send_message(conn: socket.socket, code: str, data: str) -> None:
+def build_message(code: str, data: str) -> bytearray:
+    """
+    Builds a new message using chatlib's bytes format, using code and data
+    :param code: The command of the message
+    :param data: The data of the message
+    :return: The built message, an error message if the data is too long for the protocol
+    """
+    message = bytearray()
+    if not chatlib.build_message_into(message, code, data.encode()):
+        logging.warning("%s response of %d chars is too long, sending an error instead", code, len(data))
+        chatlib.build_message_into(message, ERROR_MSG, b"Response is too long")
+    return message
+
+
+def send_message(session: Session, message: bytes) -> None:
+    """
+    Logs debug info, then appends an already built msg to the session's
+    outgoing queue. While corked, queues are flushed at the end of the loop
+    iteration, or once they reach FLUSH_THRESHOLD
+    :param session: The client's session
+    :param message: The built message
+    :return: None
+    """
+    logging.debug("[SERVER] %s", message)
+    server.send(session, message)
+
+
+def build_and_send_message(session: Session, code: str, data: str) -> None:
     """
-    Builds a new message using chatlib format, using code and data.
-    Logs debug info, then appends msg to messages_to_send
-    :param conn: The socket connection
+    Builds a new message using chatlib's bytes format, using code and data.
+    Logs debug info, then appends msg to the session's outgoing queue
+    :param session: The client's session
     :param code: The command of the message
     :param data: The data of the message
     :return: None
     """
-    global messages_to_send
-    message = chatlib.build_message(code, data)
-    logging.debug(f"[SERVER] {message}")
-    messages_to_send.append((conn, message))
+    send_message(session, build_message(code, data))
 
 
-def recv_msg_and_parse(conn: socket.socket) -> tuple[str, str] | tuple[None, None]:
+def parse_received_messages(session: Session) -> list[tuple[Command, str] | tuple[None, None]]:
     """
-    Receives a new message from given socket, logs debug info,
-    then parses the message using chatlib format
-    :param conn: The socket connection
-    :return: cmd and data of received message, (None, None) if error occurred
+    Logs debug info, then parses all complete messages in the session's
+    receive buffer using chatlib format
+    :param session: The client's session
+    :return: Command and data of every complete message received so far,
+    (None, None) for an invalid message
     """
-    full_msg = conn.recv(BUFFER_SIZE).decode()  # Get server response
-    logging.debug(f"[CLIENT] {full_msg}")
-    cmd, data = chatlib.parse_message(full_msg)
-    return cmd, data
+    buffer = session.recv_buffer
+    logging.debug("[CLIENT] %s", buffer)
+    return chatlib.parse_messages_from_buffer(buffer, commands.headers)
 
 
-def send_error(conn: socket.socket, error_msg: str) -> None:
+def send_error(session: Session, error_msg: str) -> None:
     """
-    Send a given error message to the given socket
-    :param conn: The socket connection
+    Send a given error message to the given session
+    :param session: The client's session
     :param error_msg: The error info to send back to client
     :return: None
     """
-    build_and_send_message(conn, ERROR_MSG, error_msg)
+    build_and_send_message(session, ERROR_MSG, error_msg)
 
 
-def print_client_sockets(sockets: set[socket.socket]) -> None:
+def print_client_sessions() -> None:
     """
-    Logs all sockets details in a given list of sockets
-    :param sockets: The list of the sockets
+    Logs the addresses of all connected clients
     :return: None
     """
-    # Get clients' IPs and ports, then format them in a string
-    connected_clients = ["{}:{}".format(*client.getpeername()) for client in sockets]
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return  # Don't format all clients for nothing
+
+    # Format clients' IPs and ports in a string
+    connected_clients = [str(session) for session in server.connections.values()]
 
     # Log the details
     if connected_clients:
@@ -89,347 +145,621 @@ def print_client_sockets(sockets: set[socket.socket]) -> None:
     logging.info(message)
 
 
-# DATA LOADERS
-
-
-def load_questions_from_file() -> None:
+def commit_storage() -> None:
     """
-    Loads questions dict from a JSON file.
-    The dictionary's keys are the question IDs, their values are
-    sub-dicts that contain question, 4 answers and correct answer.
+    Commits the storage, timing the call
     :return: None
     """
-    global questions
-    with open(QUESTIONS_FILE_PATH, 'r') as file:
-        questions = json.load(file)
+    start = time.perf_counter()
+    storage.commit()
+    metrics.commit_time.record(time.perf_counter() - start)
 
 
-def load_questions_from_web() -> None:
+# DATA LOADERS
+
+
+def clean_questions(questions: dict[str, dict]) -> dict[str, dict]:
     """
-    Gets questions from a web service, removes ones that contain
-    the DATA_DELIMITER (HTML codes excluded), then append a unique
-    ID for each question using hashing, create a dictionary of all
-    questions and save them to a JSON file
-    :return: None
+    Removes HTML codes from questions' data, then removes questions that
+    still contain the DATA_DELIMITER, as they can't be sent to clients
+    :param questions: Dict of question IDs and their data
+    :return: The valid questions
     """
-    global questions
-
-    # Requests will nicely log by default
-    stock = requests.get(QUESTIONS_API_URL, params=QUESTIONS_SETTINGS).json().get("results")
     data_delimiter = chatlib.DATA_DELIMITER
+    valid_questions = {}
 
-    # Remove invalid questions & append unique IDs for each question
-    for question in stock:
+    for question_id, question in questions.items():
         # Data might be with HTML codes, remove these
         question["question"] = html.unescape(question["question"])
         question["correct_answer"] = html.unescape(question["correct_answer"])
         question["incorrect_answers"] = [html.unescape(answer) for answer in question["incorrect_answers"]]
 
         # if char '#' is still in question data, ignore question
-        if data_delimiter in question["question"]\
+        if data_delimiter in question_id\
+                or data_delimiter in question["question"]\
                 or data_delimiter in question["correct_answer"]\
                 or any(data_delimiter in ans for ans in question["incorrect_answers"]):
+            logging.warning("Ignoring question %s, it contains '%s'", question_id, data_delimiter)
             continue
+        valid_questions[question_id] = question
+
+    return valid_questions
+
+
+def build_question_messages(question_id: str, question_data: dict) -> tuple[bytes, ...]:
+    """
+    Builds the YOUR_QUESTION message of a question once for every order
+    of its answers (4! = 24), so sending a question needs no string work
+    :param question_id: The ID of the question
+    :param question_data: The question, correct answer and incorrect answers
+    :return: The built messages
+    """
+    cmd = chatlib.PROTOCOL_SERVER["question_ok_msg"]
+    answers = [question_data["correct_answer"]] + question_data["incorrect_answers"]  # 1 list of all possible answers
+    return tuple(bytes(build_message(cmd, chatlib.join_data([question_id, question_data["question"], *order])))
+                 for order in itertools.permutations(answers))
+
+
+def build_all_question_messages(questions: dict[str, dict]) -> dict[str, tuple[bytes, ...]]:
+    """
+    Builds the messages of many questions, runs in a JobRunner's process pool
+    :param questions: Dict of valid question IDs and their data
+    :return: Dict of question IDs and their built messages
+    """
+    return {question_id: build_question_messages(question_id, question)
+            for question_id, question in questions.items()}
 
+
+def add_questions(questions: dict[str, dict], messages: dict[str, tuple[bytes, ...]] = None) -> None:
+    """
+    Adds valid questions to the storage and to the unasked questions of logged-in users.
+    Questions are never removed, so IDs that clients were already sent stay answerable
+    :param questions: Dict of valid question IDs and their data
+    :param messages: The questions' built messages, built here if not given
+    :return: None
+    """
+    if messages is None:
+        messages = build_all_question_messages(questions)
+    known_ids = set(storage.question_ids())
+    new_ids = [question_id for question_id in questions if question_id not in known_ids]
+
+    storage.set_questions(questions)
+    question_messages.update(messages)
+    for username, remaining in remaining_questions.items():
+        questions_asked = storage.get_questions_asked(username)
+        remaining.extend(question_id for question_id in new_ids if question_id not in questions_asked)
+
+
+def fetch_questions_from_file() -> dict[str, dict]:
+    """
+    Loads questions dict from a JSON file.
+    The dictionary's keys are the question IDs, their values are
+    sub-dicts that contain question, 4 answers and correct answer.
+    :return: Dict of valid question IDs and their data
+    """
+    with open(QUESTIONS_FILE_PATH, 'r') as file:
+        return clean_questions(json.load(file))
+
+
+def fetch_questions_from_web() -> dict[str, dict]:
+    """
+    Gets questions from a web service, then append a unique
+    ID for each question using hashing, create a dictionary of all
+    questions and save the valid ones to a JSON file
+    :return: Dict of valid question IDs and their data
+    """
+    questions = {}
+
+    # Requests will nicely log by default
+    stock = requests.get(QUESTIONS_API_URL, params=QUESTIONS_SETTINGS).json().get("results")
+
+    # Append unique IDs for each question
+    for question in stock:
         # Hash the question to get a unique ID (hash-collision changes are low)
-        question_id = hashlib.md5(question["question"].encode()).hexdigest()[:8]
+        question_id = hashlib.md5(html.unescape(question["question"]).encode()).hexdigest()[:8]
         questions[question_id] = question  # Add question to dictionary
 
+    questions = clean_questions(questions)
+
     # Save changes to a file
     with open(r"server database\web_questions.json", 'w') as file:
         json.dump(questions, file, indent=4)
 
     logging.info("Requested new questions successfully")
+    return questions
+
+
+def fetch_questions() -> dict[str, dict]:
+    """
+    :return: Valid questions from the source chosen in QUESTIONS_SOURCE
+    """
+    if QUESTIONS_SOURCE == "file":
+        return fetch_questions_from_file()
+    return fetch_questions_from_web()
 
 
-def load_user_database() -> None:
+def load_questions() -> None:
     """
-    Loads users dict from a JSON file.
-    The dictionary's keys are the usernames, their values are
-    sub-dicts that contain password, score and questions asked.
+    Loads questions into the storage, blocks until they are loaded
     :return: None
     """
-    global users
-    with open(USERS_FILE_PATH, 'r') as file:
-        users = json.load(file)
+    add_questions(fetch_questions())
 
 
-def write_to_users_file() -> None:
+def refresh_questions() -> None:
     """
-    The opposite of load_user_database():
-    writes users dict to a JSON file
+    Loads new questions without blocking the loop: they are fetched in the thread pool,
+    their messages are built in the process pool, then they are added on the loop thread
     :return: None
     """
-    global users
-    with open(USERS_FILE_PATH, 'w') as file:
-        json.dump(users, file, indent=4)
+    global next_questions_refresh
+    next_questions_refresh = None  # No other refresh until this one is done
+
+    def questions_fetched(questions: dict[str, dict]) -> None:
+        jobs.run_cpu(build_all_question_messages, questions,
+                     callback=lambda messages: questions_built(questions, messages), on_error=refresh_failed)
+
+    def questions_built(questions: dict[str, dict], messages: dict[str, tuple[bytes, ...]]) -> None:
+        global next_questions_refresh
+        add_questions(questions, messages)
+        next_questions_refresh = time.monotonic() + QUESTIONS_REFRESH_INTERVAL
+        logging.info("Refreshed %d questions", len(questions))
+
+    def refresh_failed(_error: Exception) -> None:
+        global next_questions_refresh
+        next_questions_refresh = time.monotonic() + QUESTIONS_REFRESH_INTERVAL  # Keep the current questions
+
+    jobs.run_io(fetch_questions, callback=questions_fetched, on_error=refresh_failed)
+
+
+def create_storage(job_runner: JobRunner | None = None) -> Storage:
+    """
+    Creates the storage backend chosen in STORAGE_BACKEND, then loads it
+    :param job_runner: Writes JSON snapshots in the background, if None they block the loop
+    :return: The loaded storage
+    """
+    if STORAGE_BACKEND == "sqlite":
+        new_storage = SqliteStorage(SQLITE_DB_PATH, seed_users_path=USERS_FILE_PATH)
+    else:
+        new_storage = JsonStorage(USERS_FILE_PATH, USERS_JOURNAL_PATH,
+                                  compact_interval=STORAGE_MAINTAIN_INTERVAL, jobs=job_runner)
+    new_storage.load()
+    return new_storage
 
 
 # MESSAGE HANDLING
 
-def handle_get_score_message(conn: socket.socket) -> None:
+@commands.register(chatlib.PROTOCOL_CLIENT["get_score_msg"])
+def handle_get_score_message(session: Session, _data: str) -> None:
     """
-    Gets the score of a given socket, then sends it back to client
-    :param conn: The socket connection
+    Gets the score of a given session's user, then sends it back to client
+    :param session: The client's session
     :return: None
     """
-    global users
     cmd = chatlib.PROTOCOL_SERVER["my_score_ok_msg"]
-    username = logged_users.get(conn.getpeername())
-    data = str(users.get(username)["score"])
-    build_and_send_message(conn, cmd, data)
+    data = str(storage.get_score(session.username))
+    build_and_send_message(session, cmd, data)
 
 
-def handle_highscore_message(conn: socket.socket) -> None:
+@commands.register(chatlib.PROTOCOL_CLIENT["get_highscore_msg"])
+def handle_highscore_message(session: Session, _data: str) -> None:
     """
     Finds the top 5 players, then sends them
-    back as 'name: score\nname: score...'
-    :param conn: The socket connection
+    back as 'name: score\nname: score...'.
+    The built response is reused until some score changes,
+    in any worker
+    :param session: The client's session
     :return: None
     """
-    global users
-    cmd = chatlib.PROTOCOL_SERVER["highscore_ok_msg"]
+    global highscore_message, highscore_version
 
-    # Get raw data of top 5 users with the highest score
-    sorted_users = sorted(users.items(), key=lambda x: x[1]["score"], reverse=True)[:5]
-    # Joined with '\n' instead of adding '\n' to every element
-    data = "\n".join([f"{name}: {value['score']}" for name, value in sorted_users])
+    version = storage.score_version() if shared_state is not None else None  # Read before the scores
+    if highscore_message is None or version != highscore_version:
+        highscore_version = version
+        # Get raw data of top 5 users with the highest score
+        top_users = storage.top_scores(HIGHSCORE_TABLE_SIZE)
+        # Joined with '\n' instead of adding '\n' to every element
+        data = "\n".join([f"{name}: {score}" for name, score in top_users])
+        highscore_message = bytes(build_message(chatlib.PROTOCOL_SERVER["highscore_ok_msg"], data))
 
-    build_and_send_message(conn, cmd, data)
+    send_message(session, highscore_message)
 
 
-def handle_logged_message(conn: socket.socket) -> None:
+@commands.register(chatlib.PROTOCOL_CLIENT["get_logged_msg"])
+def handle_logged_message(session: Session, _data: str) -> None:
     """
     Sends back all currently logged-in usernames
-    :param conn: The socket connection
+    :param session: The client's session
     :return: None
     """
-    global logged_users
     cmd = chatlib.PROTOCOL_SERVER["all_logged_msg"]
-    data = ", ".join(logged_users.values())
-    build_and_send_message(conn, cmd, data)
+    if shared_state is None:
+        data = ", ".join(other.username for other in server.connections.values() if other.username is not None)
+    else:
+        data = ", ".join(shared_state.logged_usernames())  # Users of all workers
+    if len(data.encode()) > chatlib.MAX_DATA_LENGTH:
+        # Too many users for one message, send as many whole names as fit
+        data = data.encode()[:chatlib.MAX_DATA_LENGTH + 1].decode(errors="ignore").rsplit(", ", 1)[0]
+    build_and_send_message(session, cmd, data)
 
 
-def handle_logout_message(conn: socket.socket) -> None:
+@commands.register(chatlib.PROTOCOL_CLIENT["logout_msg"])
+def handle_logout_message(session: Session, _data: str = "") -> None:
     """
-    Closes the given socket and removes user from logged_users dict
-    :param conn: The socket connection
+    Closes the session's socket, its user is logged out by logout_session()
+    :param session: The client's session
     :return: None
     """
-    global logged_users, client_sockets
+    server.close(session)
 
-    # Try to get client info
-    try:
-        client_address = conn.getpeername()
-        logged_users.pop(client_address)
-    except (OSError, KeyError):
-        # The client was forced-closed
-        client_address = "unknown"
 
-    client_sockets.remove(conn)
-    conn.close()
-    logging.debug(f"Connection closed for client {client_address}")
-    print_client_sockets(client_sockets)
+def logout_session(session: Session) -> None:
+    """
+    Logs out the user of a closed session
+    :param session: The client's session
+    :return: None
+    """
+    username = session.username
+    if username is not None:
+        if shared_state is not None:
+            shared_state.remove_logged_user(username)
+        user_sessions[username] -= 1
+        if not user_sessions[username]:
+            del user_sessions[username]
+            remaining_questions.pop(username, None)  # Rebuilt from questions asked on the next login
 
+    logging.debug("Connection closed for client %s", session)
+    print_client_sessions()
 
-def handle_login_message(conn: socket.socket, data: str) -> None:
+
+@commands.register(chatlib.PROTOCOL_CLIENT["login_msg"], login_required=False)
+def handle_login_message(session: Session, data: str) -> None:
     """
-    Validates given login info with users dict. Sends an error to client if needed,
-    else sends OK message and adds user and address to logged_users dict
-    :param conn: The socket connection
+    Validates given login info with the storage. Sends an error to client if needed,
+    else sends OK message and sets the session's user
+    :param session: The client's session
     :param data: The login info to validate
     :return: None
     """
-    global users, logged_users
-    data = chatlib.split_data(data, 2)
-    username, password = data
+    if session.username is not None:
+        send_error(session, "Already logged-in")
+        return
+
+    fields = chatlib.split_data(data, 2)
+    if len(fields) != 2:
+        send_error(session, "Login info must be username#password")
+        return
+    username, password = fields
 
     # Validate login info
-    if username not in users.keys():
-        send_error(conn, "Username does not exist")
+    user_password = storage.get_password(username)
+    if user_password is None:
+        send_error(session, "Username does not exist")
         return
-    if password != users[username]["password"]:
-        send_error(conn, "Password does not match")
+    if password != user_password:
+        send_error(session, "Password does not match")
         return
 
     # All ok
-    logged_users[conn.getpeername()] = username
+    session.username = username
+    session.remaining = remaining_questions.get(username)  # Listed on the next question, if not logged-in already
+    user_sessions[username] = user_sessions.get(username, 0) + 1
+    if shared_state is not None:
+        shared_state.add_logged_user(username)
     cmd = chatlib.PROTOCOL_SERVER["login_ok_msg"]
-    build_and_send_message(conn, cmd, "")
+    build_and_send_message(session, cmd, "")
 
 
-def create_random_question(username: str) -> str | None:
+def pick_unasked_question(session: Session) -> tuple[str, dict] | None:
     """
-    Picks a random question, then returns it
-    in the format 'id#question#ans1#ans2#...#correct'
-    :return: The random question in the protocol format, None if no questions left
+    Picks a random question that the session's user was not asked yet.
+    The user's unasked IDs are listed once per login, then every pick
+    swaps a random ID with the last one and pops it, which is O(1)
+    :param session: The session to pick a question for
+    :return: The question ID and its data, None if no questions left
     """
-    global questions, users
+    remaining = session.remaining
+    if remaining is None:
+        remaining = remaining_questions.get(session.username)  # Listed by another session of the user
+        if remaining is None:
+            # Get questions' IDs that were not asked
+            questions_asked = storage.get_questions_asked(session.username)
+            remaining = [question_id for question_id in storage.question_ids() if question_id not in questions_asked]
+            remaining_questions[session.username] = remaining
+        session.remaining = remaining
+
+    while remaining:
+        index = random.randrange(len(remaining))  # Get a random ID
+        remaining[index], remaining[-1] = remaining[-1], remaining[index]
+        question_id = remaining.pop()
+
+        question_data = storage.get_question(question_id)
+        if question_data is not None:  # Question might have been removed
+            return question_id, question_data
+
+    return None  # All questions were asked
 
-    # Get questions' IDs that were not asked
-    questions_asked = set(users[username]["questions_asked"])
-    questions_not_asked = set(questions.keys()).difference(questions_asked)
-    if not questions_not_asked:
-        # All questions were asked
+
+def create_random_question(session: Session) -> bytes | None:
+    """
+    Picks a random question, then returns its built message
+    with the answers in a random order, in the format 'id#question#ans1#ans2#...'
+    :return: The random question message in the protocol format, None if no questions left
+    """
+    picked = pick_unasked_question(session)
+    if picked is None:
         return None
 
-    # Pick a question & convert to protocol's format
-    question_id = random.sample(list(questions_not_asked), k=1)[0]  # Get a random ID
-    question_data = questions[question_id]
-    actual_question = html.unescape(question_data["question"])  # Data might be with HTML codes, remove these
-    answers = [question_data["correct_answer"]] + question_data["incorrect_answers"]  # 1 list of all possible answers
-    random.shuffle(answers)  # Randomize order of answers
-    data = [str(question_id), actual_question, *answers]
-    return chatlib.join_data(data)
+    question_id, question_data = picked
+    messages = question_messages.get(question_id)
+    if messages is None:
+        # Question was in the storage before this run
+        messages = question_messages[question_id] = build_question_messages(question_id, question_data)
+    return random.choice(messages)  # Randomize order of answers
 
 
-def handle_question_message(conn: socket.socket) -> None:
+@commands.register(chatlib.PROTOCOL_CLIENT["get_question_msg"])
+def handle_question_message(session: Session, _data: str) -> None:
     """
     Sends back to client a random question
-    :param conn: The socket connection
+    :param session: The client's session
     :return: None
     """
-    global logged_users
-    username = logged_users.get(conn.getpeername())
-
     # Get a random question
-    question = create_random_question(username)
+    question = create_random_question(session)
     if question is None:
         # No questions left
-        cmd = chatlib.PROTOCOL_SERVER["no_questions_msg"]
-        data = ""
+        build_and_send_message(session, chatlib.PROTOCOL_SERVER["no_questions_msg"], "")
     else:
         # Send question to client
-        cmd = chatlib.PROTOCOL_SERVER["question_ok_msg"]
-        data = question
+        send_message(session, question)
 
-    build_and_send_message(conn, cmd, data)
 
-
-def inc_score(username: str, points: int = POINTS_PER_QUESTION) -> None:
-    """
-    Increments score for a given username
-    :param username: The user to inc their score
-    :param points: Num of points to inc-by (default is POINTS_PER_QUESTION)
-    :return: None
+@commands.register(chatlib.PROTOCOL_CLIENT["send_answer_msg"])
+def handle_answer_message(session: Session, data: str) -> None:
     """
-    global users
-    users.get(username)["score"] += points
-    # Write changes to database later in handle_answer_message()
-
-
-def handle_answer_message(conn: socket.socket, data: str) -> None:
-    """
-    Increments username's score if the answer is right,
-    adds qID to questions asked,
-    then applies changes to file database and
+    Records the answer in the storage: increments username's score
+    if the answer is right and adds qID to questions asked,
     then sends feedback back to the client
-    :param conn: The socket connection
+    :param session: The client's session
     :param data: question_id#user_answer
     :return: None
     """
-    global questions, users
-    username = logged_users.get(conn.getpeername())
-    question_id, answer = chatlib.split_data(data, 2)
-    correct_answer = questions[question_id]["correct_answer"]
-
-    # Add qID to questions asked
-    users[username]["questions_asked"].append(question_id)
+    global highscore_message
+    fields = chatlib.split_data(data, 2)
+    question = storage.get_question(fields[0]) if len(fields) == 2 else None
+    if question is None:
+        send_error(session, "Question does not exist")
+        return
+    question_id, answer = fields
+    correct_answer = question["correct_answer"]
 
     # Handle & check answer
     if answer == correct_answer:
-        inc_score(username)
+        points = POINTS_PER_QUESTION
+        highscore_message = None  # Scores changed
         cmd = chatlib.PROTOCOL_SERVER["correct_answer_msg"]
         data_to_send = ""
     else:
+        points = 0
         cmd = chatlib.PROTOCOL_SERVER["wrong_answer_msg"]
         data_to_send = correct_answer
 
-    write_to_users_file()  # Apply questions_asked and score inc to database
-    build_and_send_message(conn, cmd, data_to_send)
+    storage.record_answer(session.username, question_id, points)  # Apply questions_asked and score inc to database
+    build_and_send_message(session, cmd, data_to_send)
 
 
-def handle_client_message(conn: socket.socket, cmd: str, data: str) -> None:
+@commands.register(chatlib.PROTOCOL_CLIENT["get_metrics_msg"])
+def handle_metrics_message(session: Session, _data: str) -> None:
     """
-    Sends the data to another function based on the command
-    :param conn: The socket connection
-    :param cmd: The command of the message
-    :param data: The data of the message
+    Sends back the server's metrics as JSON, only to admins.
+    In multi-worker mode, the metrics are of the worker the client is connected to
+    :param session: The client's session
     :return: None
     """
-    global logged_users
+    if session.username not in ADMIN_USERS:
+        send_error(session, "Only admins can get metrics")
+        return
+
+    sessions = server.connections.values()
+    report = metrics.to_dict()
+    report["bytes_in"] = server.bytes_in
+    report["bytes_out"] = server.bytes_out
+    report["commands"] = commands.stats()
+    # Queue depths
+    report["sessions"] = len(sessions)
+    report["queued_bytes"] = sum(other.outgoing_size for other in sessions)
+    report["max_queued_bytes"] = max((other.outgoing_size for other in sessions), default=0)
+    report["sessions_waiting_to_write"] = sum(other.waiting_to_write for other in sessions)
+
+    cmd = chatlib.PROTOCOL_SERVER["metrics_ok_msg"]
+    build_and_send_message(session, cmd, json.dumps(report, separators=(",", ":")))
 
-    if conn.getpeername() not in logged_users.keys():
-        if cmd == "LOGIN":  # chatlib.PROTOCOL_CLIENT.get("login_msg")
-            handle_login_message(conn, data)
-        else:
-            send_error(conn, "Login first before using this command")
+
+@commands.register(*chatlib.PROTOCOL_SERVER.values())
+def handle_unknown_message(session: Session, _data: str) -> None:
+    """
+    Handles server commands sent by a client
+    :param session: The client's session
+    :return: None
+    """
+    send_error(session, "Command does not exist")
+
+
+def handle_client_message(session: Session, command: Command, data: str) -> None:
+    """
+    Sends the data to the command's registered handler
+    :param session: The client's session
+    :param command: The command of the message
+    :param data: The data of the message
+    :return: None
+    """
+    if command.login_required and session.username is None:
+        send_error(session, "Login first before using this command")
         return
+    command(session, data)
+
 
-    # User logged-in
-    match cmd:
-        case "LOGOUT":  # chatlib.PROTOCOL_CLIENT.get("logout_msg")
-            handle_logout_message(conn)
-        case "MY_SCORE":  # chatlib.PROTOCOL_CLIENT.get("get_score_msg")
-            handle_get_score_message(conn)
-        case "HIGHSCORE":  # chatlib.PROTOCOL_CLIENT.get("get_highscore_msg")
-            handle_highscore_message(conn)
-        case "LOGGED":  # chatlib.PROTOCOL_CLIENT.get("get_logged_msg")
-            handle_logged_message(conn)
-        case "GET_QUESTION":  # chatlib.PROTOCOL_CLIENT.get("get_question_msg")
-            handle_question_message(conn)
-        case "SEND_ANSWER":  # chatlib.PROTOCOL_CLIENT.get("send_answer_msg")
-            handle_answer_message(conn, data)
-        case _:
-            send_error(conn, "Command does not exist")
+def handle_received_messages(session: Session) -> None:
+    """
+    Handles every complete message a client sent, or disconnects the client
+    :param session: The client's session
+    :return: None
+    """
+    for command, data in parse_received_messages(session):
+        if command is None:
+            # Invalid message, drop the client
+            server.close(session)
+            return
+        # Handle client command
+        handle_client_message(session, command, data)
+        if session.closed:
+            return  # Client logged out, ignore the rest
+
+
+class TriviaServer(tcp_server.TCPServer):
+    """
+    The server core (see tcp_server.py) with the trivia game's handlers
+    """
+    connection_class = Session
+
+    def handle_connect(self, session: Session) -> None:
+        print_client_sessions()
+
+    def handle_data(self, session: Session) -> None:
+        handle_received_messages(session)
+
+    def handle_disconnect(self, session: Session) -> None:
+        logout_session(session)
+
+    def before_flush(self) -> None:
+        commit_storage()  # Answers are written before they are acknowledged
+
+    def handle_iteration(self) -> None:
+        commit_storage()
+        storage.maintain()
+        if next_questions_refresh is not None and time.monotonic() >= next_questions_refresh:
+            refresh_questions()
+
+    def serve_iteration(self, timeout: float | None) -> float:
+        loop_time = super().serve_iteration(timeout)
+        metrics.loop_time.record(loop_time)
+        return loop_time
+
+
+def stop_server(signum: int, _frame) -> None:
+    """
+    Signal handler, exits the main loop so the storage is closed properly
+    :param signum: The received signal
+    :return: None
+    """
+    raise SystemExit(f"Got signal {signum}")
+
+
+def serve(server_socket: socket.socket) -> None:
+    """
+    The server loop: accepts clients, handles their messages and sends responses,
+    refreshes questions in the background, until interrupted. Closes the storage at the end
+    :param server_socket: The listening socket
+    :return: None
+    """
+    global server, next_questions_refresh
+    server = TriviaServer(server_socket, MAX_CLIENTS, cork=CORK_RESPONSES, flush_threshold=FLUSH_THRESHOLD)
+    server.watch(jobs, jobs.run_callbacks)  # Readable when background jobs are done
+    next_questions_refresh = time.monotonic() + QUESTIONS_REFRESH_INTERVAL
+    try:
+        server.serve_forever(timeout=STORAGE_MAINTAIN_INTERVAL)  # Logs everyone out at the end
+    except KeyboardInterrupt:
+        logging.info("Server is shutting down...")
+    finally:
+        for name, stats in commands.stats().items():
+            logging.info("%s: %d messages, %.1fus avg, %dus p99, %.1fus max",
+                         name, stats["count"], stats["avg_us"], stats["p99_us"], stats["max_us"])
+        try:
+            jobs.shutdown()  # Lets background writes finish first
+        finally:
+            storage.close()
+
+
+def run_worker(coordinator_address, score_version) -> None:
+    """
+    Runs in a worker process: accepts clients on the shared port
+    and uses the coordinator's storage and logged-in users
+    :param coordinator_address: Address of the coordinator's manager
+    :param score_version: Shared multiprocessing.Value, see cluster.RemoteStorage
+    :return: None
+    """
+    global storage, shared_state, jobs, metrics
+    metrics = ServerMetrics()
+    jobs = JobRunner()
+    shared_state = cluster.connect_to_coordinator(coordinator_address)
+    storage = cluster.RemoteStorage(shared_state, score_version)
+
+    # The kernel spreads new connections between all workers
+    server_socket = socket.create_server((SERVER_IP, SERVER_PORT), reuse_port=True)
+    serve(server_socket)
+
+
+def run_cluster() -> None:
+    """
+    Starts a coordinator process that owns the storage, loads questions
+    into it, then runs NUM_WORKERS worker processes until interrupted
+    :return: None
+    """
+    global storage
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise ValueError("NUM_WORKERS > 1 needs SO_REUSEPORT, which this platform does not support")
+
+    manager = cluster.start_coordinator(create_storage)
+    state = manager.get_shared_state()
+    storage = cluster.RemoteStorage(state)
+    load_questions()
+
+    score_version = multiprocessing.Value("Q", 0)  # Shared memory, workers bump it when scores change
+    workers = [multiprocessing.Process(target=run_worker, args=(manager.address, score_version),
+                                       name=f"worker-{index}")
+               for index in range(NUM_WORKERS)]
+    signal.signal(signal.SIGTERM, stop_server)  # Workers inherit it
+    for worker in workers:
+        worker.start()
+    logging.info("Server is up and listening on port %d with %d workers...", SERVER_PORT, NUM_WORKERS)
+
+    try:
+        while any(worker.is_alive() for worker in workers):
+            wait([worker.sentinel for worker in workers], timeout=STORAGE_MAINTAIN_INTERVAL)
+            state.call("maintain")
+    except KeyboardInterrupt:
+        logging.info("Server is shutting down...")
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        state.call("close")
+        manager.shutdown()
 
 
 def main():
-    global users, questions, client_sockets, messages_to_send
+    global storage, jobs
 
     # Config logging for info & debug
-    logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(message)s')
+    log_format = '%(levelname)s: %(message)s' if NUM_WORKERS == 1 else '%(levelname)s: %(processName)s: %(message)s'
+    logging.basicConfig(level=LOG_LEVEL, format=log_format)
+
+    if NUM_WORKERS > 1:
+        run_cluster()
+        return
 
     # Load data
-    load_user_database()
-    load_questions_from_web()
-    # load_questions()  # From a static file
+    jobs = JobRunner()
+    storage = create_storage(jobs)
+    load_questions()
 
     server_socket = socket.create_server((SERVER_IP, SERVER_PORT))
-    logging.info(f"Server is up and listening on port {SERVER_PORT}...")
-
-    while True:
-        # Scan new data from all sockets into lists
-        ready_to_read, ready_to_write, _ = select.select({server_socket}.union(client_sockets), client_sockets, [])
-
-        # Scan the ready-to-read sockets
-        for current_socket in ready_to_read:
-            if current_socket is server_socket:
-                # Add new clients
-                client_socket, client_addr = current_socket.accept()
-                client_sockets.add(client_socket)
-                print_client_sockets(client_sockets)
-            else:
-                # Handle clients
-                try:
-                    cmd, data = recv_msg_and_parse(current_socket)
-                except (ConnectionResetError, ConnectionAbortedError):
-                    handle_logout_message(current_socket)
-                    continue
-
-                if not bool(cmd):
-                    # Empty string, user wants to disconnect
-                    handle_logout_message(current_socket)
-                else:
-                    # Handle client command
-                    handle_client_message(current_socket, cmd, data)
-
-        # Send all messages
-        for msg in messages_to_send:
-            conn, data = msg
-            if conn in ready_to_write:
-                conn.send(data.encode())  # Send to client
-                messages_to_send.remove(msg)
+    logging.info("Server is up and listening on port %d...", SERVER_PORT)
+
+    signal.signal(signal.SIGTERM, stop_server)
+    serve(server_socket)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,21 @@
+"""
+Per-connection state of the trivia server
+"""
+from tcp_core import tcp_server
+
+
+class Session(tcp_server.Connection):
+    """
+    A connected client: its socket, buffers (see tcp_server.Connection) and the logged-in user.
+    Handlers get the session itself, so finding the user needs no syscall
+    """
+    __slots__ = ("username", "remaining")
+
+    def __init__(self, conn, address: tuple):
+        """
+        :param conn: The client's socket
+        :param address: The client's IP and port, as returned by accept()
+        """
+        super().__init__(conn, address)
+        self.username = None  # Set when the client logs in
+        self.remaining = None  # The user's unasked question IDs, shared by all sessions of the user
@@ -0,0 +1,561 @@
+"""
+Storage backends of the trivia server: users (password, score, questions asked) and questions.
+The server only talks to a Storage, so backends can be swapped in server_trivia.STORAGE_BACKEND
+"""
+import abc
+import base64
+import json
+import logging
+import os
+import sqlite3
+import string
+import shutil
+import time
+from jobs import JobRunner
+from leaderboard import Leaderboard
+
+QUESTION_ID_LENGTH = 8  # Web question IDs are 8 hex digits, 32 bits each
+
+
+def is_packable(question_id: str) -> bool:
+    """
+    :param question_id: The ID to check
+    :return: True if the ID is 8 lowercase hex digits, so it fits in 32 bits
+    """
+    return len(question_id) == QUESTION_ID_LENGTH and question_id == question_id.lower()\
+        and all(char in string.hexdigits for char in question_id)
+
+
+def pack_question_ids(question_ids: set[str]) -> str | dict[str, str | list[str]]:
+    """
+    Encodes asked question IDs for the users file. 8-hex-digit IDs
+    are packed as 4 bytes each and base64-ed, which is about 3 times smaller
+    than a JSON list. Other IDs can't be packed, if there are any
+    they are kept in a list next to the packed ones
+    :param question_ids: The IDs to encode
+    :return: The packed IDs, or {"packed": packed IDs, "other": [other IDs]}
+    """
+    packable = [question_id for question_id in question_ids if is_packable(question_id)]
+    packed = base64.b64encode(bytes.fromhex("".join(packable))).decode()
+    if len(packable) == len(question_ids):
+        return packed
+
+    return {"packed": packed, "other": sorted(question_ids.difference(packable))}
+
+
+def unpack_question_ids(encoded: str | dict[str, str | list[str]] | list[str]) -> set[str]:
+    """
+    The opposite of pack_question_ids(), also reads plain lists of IDs
+    :param encoded: The IDs as stored in the users file
+    :return: The set of IDs
+    """
+    if isinstance(encoded, list):
+        return set(encoded)
+
+    other = []
+    if isinstance(encoded, dict):
+        encoded, other = encoded["packed"], encoded["other"]
+
+    hex_ids = base64.b64decode(encoded).hex()
+    question_ids = {hex_ids[i:i + QUESTION_ID_LENGTH] for i in range(0, len(hex_ids), QUESTION_ID_LENGTH)}
+    question_ids.update(other)
+    return question_ids
+
+
+def serialize_users(snapshot: dict[str, dict]) -> str:
+    """
+    Formats a users snapshot as the users file's JSON. Module-level,
+    so a JobRunner's process pool can run it
+    :param snapshot: Dict of usernames and their password, score and packed questions asked
+    :return: The JSON text
+    """
+    return json.dumps(snapshot, indent=4)
+
+
+def write_file_atomically(path: str, text: str) -> None:
+    """
+    Writes to a temp file first, then replaces the old file,
+    so a crash never leaves a half-written file
+    :param path: The file to write
+    :param text: The new content of the file
+    :return: None
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)  # Atomic rename
+
+
+class Storage(abc.ABC):
+    """
+    The interface every storage backend implements.
+    Changes may be buffered, they are durable once commit() returns
+    """
+
+    @abc.abstractmethod
+    def load(self) -> None:
+        """
+        Opens the storage and loads whatever is needed to serve requests
+        :return: None
+        """
+
+    @abc.abstractmethod
+    def get_password(self, username: str) -> str | None:
+        """
+        :param username: The user to get their password
+        :return: The user's password, None if the user does not exist
+        """
+
+    @abc.abstractmethod
+    def get_score(self, username: str) -> int:
+        """
+        :param username: The user to get their score
+        :return: The user's score
+        """
+
+    @abc.abstractmethod
+    def get_questions_asked(self, username: str) -> set[str]:
+        """
+        :param username: The user to get their asked questions
+        :return: The IDs of all questions the user already answered
+        """
+
+    @abc.abstractmethod
+    def record_answer(self, username: str, question_id: str, points: int) -> None:
+        """
+        Adds a question to the user's asked questions and adds points to their score
+        :param username: The user that answered
+        :param question_id: The ID of the answered question
+        :param points: Num of points the user got for the answer
+        :return: None
+        """
+
+    @abc.abstractmethod
+    def top_scores(self, count: int) -> list[tuple[str, int]]:
+        """
+        :param count: Num of users to return
+        :return: (username, score) of the users with the highest scores, highest first
+        """
+
+    @abc.abstractmethod
+    def set_questions(self, questions: dict[str, dict]) -> None:
+        """
+        Adds questions to the storage, replacing questions with the same IDs
+        :param questions: Dict of question IDs and their question, correct answer and incorrect answers
+        :return: None
+        """
+
+    @abc.abstractmethod
+    def get_question(self, question_id: str) -> dict | None:
+        """
+        :param question_id: The ID of the question
+        :return: The question, correct answer and incorrect answers, None if there is no such question
+        """
+
+    @abc.abstractmethod
+    def question_ids(self) -> list[str]:
+        """
+        :return: The IDs of all questions
+        """
+
+    @abc.abstractmethod
+    def commit(self) -> None:
+        """
+        Makes all buffered changes durable. Called before answers are acknowledged
+        :return: None
+        """
+
+    def maintain(self) -> None:
+        """
+        Periodic housekeeping, called from the server loop
+        :return: None
+        """
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """
+        Commits all changes and releases the storage
+        :return: None
+        """
+
+
+class JsonStorage(Storage):
+    """
+    Keeps everything in dicts. Users are loaded from a JSON snapshot, answers are
+    appended to a journal that is replayed on load and compacted into a new snapshot
+    """
+
+    def __init__(self, users_path: str, journal_path: str,
+                 compact_interval: float = 60, compact_threshold: int = 10_000, jobs: JobRunner | None = None):
+        """
+        :param users_path: Path of the users JSON snapshot
+        :param journal_path: Path of the answers journal
+        :param compact_interval: Max seconds between snapshots of a non-empty journal
+        :param compact_threshold: Snapshot right away once the journal has this many records
+        :param jobs: Runs snapshots in the background, if None they block the caller
+        """
+        self.users_path = users_path
+        self.journal_path = journal_path
+        self.old_journal_path = f"{journal_path}.old"  # Records of a snapshot that is being written
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+        self.users = {}
+        self.leaderboard = Leaderboard()
+        self.questions = {}
+        self.journal_file = None  # Append-only log of answers since the last snapshot
+        self.journal_records = 0  # Num of records in journal_file
+        self.unsynced = False  # Records were written since the last commit()
+        self.last_compaction = time.monotonic()
+        self.jobs = jobs
+        self.compacting = False  # A snapshot is being written in the background
+
+    def load(self) -> None:
+        """
+        Loads users dict from a JSON file, then replays the answers journal
+        on top of it and opens the journal for appending.
+        The dictionary's keys are the usernames, their values are
+        sub-dicts that contain password, score and questions asked.
+        Questions asked are kept as sets in memory
+        :return: None
+        """
+        with open(self.users_path, 'r') as file:
+            self.users = json.load(file)
+        for user in self.users.values():
+            user["questions_asked"] = unpack_question_ids(user["questions_asked"])
+
+        self.replay_journal()
+        self.leaderboard = Leaderboard({name: user["score"] for name, user in self.users.items()})
+        self.journal_file = open(self.journal_path, 'a')
+        if not self.journal_ends_with_newline():
+            self.journal_file.write("\n")  # End a record torn by a crash, so the next one gets its own line
+
+    def replay_journal(self) -> None:
+        """
+        Applies all records in the answers journals to users dict, the journal of
+        an unfinished snapshot first. A record holds the user's score after the answer,
+        so replaying records that are already in the snapshot changes nothing
+        :return: None
+        """
+        self.journal_records = 0
+        for path in (self.old_journal_path, self.journal_path):
+            if os.path.exists(path):
+                self.replay_journal_file(path)
+        logging.info("Replayed %d journal records", self.journal_records)
+
+    def replay_journal_file(self, path: str) -> None:
+        """
+        Applies all records in a journal file to users dict
+        :param path: The journal file
+        :return: None
+        """
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    username, question_id, _points, score = json.loads(line)
+                except ValueError:
+                    # The server crashed in the middle of writing this record
+                    logging.warning("Skipping a broken journal record: %r", line)
+                    continue
+
+                user = self.users.get(username)
+                if user is None:
+                    continue
+                user["questions_asked"].add(question_id)
+                user["score"] = score
+                self.journal_records += 1
+
+    def journal_ends_with_newline(self) -> bool:
+        """
+        :return: False if the journal's last record is missing its newline, True if it's empty
+        """
+        with open(self.journal_path, 'rb') as file:
+            if file.seek(0, os.SEEK_END) == 0:
+                return True
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def get_password(self, username: str) -> str | None:
+        user = self.users.get(username)
+        return None if user is None else user["password"]
+
+    def get_score(self, username: str) -> int:
+        return self.users[username]["score"]
+
+    def get_questions_asked(self, username: str) -> set[str]:
+        """
+        Returns the user's own set, without copying it
+        """
+        return self.users[username]["questions_asked"]
+
+    def record_answer(self, username: str, question_id: str, points: int) -> None:
+        """
+        Applies the answer to users dict, then appends it to the journal.
+        Records are buffered, commit() writes them all at once
+        """
+        user = self.users[username]
+        user["questions_asked"].add(question_id)
+        user["score"] += points
+        if points:
+            self.leaderboard.update(username, user["score"])
+
+        record = [username, question_id, points, user["score"]]
+        self.journal_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.journal_records += 1
+        self.unsynced = True
+
+    def top_scores(self, count: int) -> list[tuple[str, int]]:
+        return self.leaderboard.top(count)
+
+    def set_questions(self, questions: dict[str, dict]) -> None:
+        self.questions.update(questions)
+
+    def get_question(self, question_id: str) -> dict | None:
+        return self.questions.get(question_id)
+
+    def question_ids(self) -> list[str]:
+        return list(self.questions.keys())
+
+    def commit(self) -> None:
+        """
+        Flushes the journal and fsyncs it, so its records survive an OS crash too.
+        Does nothing if no records were written, since it's called every loop iteration
+        """
+        if not self.unsynced:
+            return
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.unsynced = False
+
+    def snapshot_users(self) -> dict[str, dict]:
+        """
+        Copies users dict in the users file's format. The copy shares
+        no mutable objects with users dict, so it can be serialized anywhere
+        :return: Dict of usernames and their password, score and packed questions asked
+        """
+        return {name: {**user, "questions_asked": pack_question_ids(user["questions_asked"])}
+                for name, user in self.users.items()}
+
+    def write_to_users_file(self) -> None:
+        """
+        The opposite of load():
+        writes users dict to a JSON file, atomically
+        :return: None
+        """
+        write_file_atomically(self.users_path, serialize_users(self.snapshot_users()))
+
+    def compact_journal(self) -> None:
+        """
+        Writes a new users snapshot, then empties the journals,
+        does nothing if they are empty. Blocks until the snapshot is written
+        :return: None
+        """
+        self.last_compaction = time.monotonic()
+        has_old_journal = os.path.exists(self.old_journal_path)
+        if not self.journal_records and not has_old_journal:
+            return
+
+        self.commit()
+        self.write_to_users_file()
+        self.journal_file.truncate(0)  # Records are in the snapshot now
+        if has_old_journal:
+            os.remove(self.old_journal_path)
+        logging.debug("Compacted %d journal records", self.journal_records)
+        self.journal_records = 0
+
+    def rotate_journal(self) -> None:
+        """
+        Moves the journal's records aside to the old journal and starts an empty journal.
+        If an old journal is left from a failed snapshot, the records are appended to it
+        :return: None
+        """
+        self.commit()
+        self.journal_file.close()
+        if os.path.exists(self.old_journal_path):
+            with open(self.journal_path, 'r') as journal, open(self.old_journal_path, 'a') as old_journal:
+                shutil.copyfileobj(journal, old_journal)
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.old_journal_path)
+
+        self.journal_file = open(self.journal_path, 'a')
+        self.journal_records = 0
+
+    def start_compaction(self) -> None:
+        """
+        Starts writing a new users snapshot in the background: the journal is rotated
+        and users dict is copied on the caller's thread, then the copy is serialized
+        in the process pool and written in the thread pool
+        :return: None
+        """
+        self.last_compaction = time.monotonic()
+        if not self.journal_records:
+            return
+
+        self.rotate_journal()
+        self.compacting = True
+        self.jobs.run_cpu(serialize_users, self.snapshot_users(),
+                          callback=self.write_snapshot, on_error=self.compaction_failed)
+
+    def write_snapshot(self, text: str) -> None:
+        """
+        Called with the serialized snapshot, writes it in the thread pool
+        :param text: The users file's new JSON
+        :return: None
+        """
+        self.jobs.run_io(write_file_atomically, self.users_path, text,
+                         callback=self.compaction_done, on_error=self.compaction_failed)
+
+    def compaction_done(self, _result) -> None:
+        """
+        Called when the snapshot is written, its records are not needed anymore
+        :return: None
+        """
+        os.remove(self.old_journal_path)
+        logging.debug("Wrote users snapshot in the background")
+        self.compacting = False
+
+    def compaction_failed(self, _error: Exception) -> None:
+        """
+        Called if the snapshot could not be written. The old journal is kept,
+        so its records are replayed on load or go into the next snapshot
+        :return: None
+        """
+        self.compacting = False
+
+    def maintain(self) -> None:
+        """
+        Compacts the journal if it got too long,
+        or if compact_interval passed since the last compaction
+        """
+        if self.compacting:
+            return
+        if self.journal_records >= self.compact_threshold\
+                or time.monotonic() - self.last_compaction >= self.compact_interval:
+            if self.jobs is None:
+                self.compact_journal()
+            else:
+                self.start_compaction()
+
+    def close(self) -> None:
+        """
+        Writes a final snapshot. A background snapshot must be finished
+        first, by shutting the JobRunner down
+        """
+        self.compact_journal()
+        self.journal_file.close()
+
+
+class SqliteStorage(Storage):
+    """
+    Keeps users, questions and asked questions in indexed SQLite tables,
+    so nothing has to fit in memory. Changes of a loop iteration share one transaction
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            score INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS users_by_score ON users (score DESC);
+        CREATE TABLE IF NOT EXISTS questions (
+            question_id TEXT PRIMARY KEY,
+            question TEXT NOT NULL,
+            correct_answer TEXT NOT NULL,
+            incorrect_answers TEXT NOT NULL  -- JSON list
+        );
+        CREATE TABLE IF NOT EXISTS questions_asked (
+            username TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            PRIMARY KEY (username, question_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path: str, seed_users_path: str | None = None):
+        """
+        :param db_path: Path of the SQLite database file
+        :param seed_users_path: Users JSON file to import if the database has no users
+        """
+        self.db_path = db_path
+        self.seed_users_path = seed_users_path
+        self.db = None
+
+    def load(self) -> None:
+        """
+        Opens the database and creates the tables if needed.
+        Imports the seed users file into an empty database
+        :return: None
+        """
+        # A multi-worker coordinator calls from several threads, one at a time
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")  # Every commit is fsynced, like JsonStorage.commit()
+        self.db.executescript(self.SCHEMA)
+
+        has_users = self.db.execute("SELECT 1 FROM users LIMIT 1").fetchone()
+        if not has_users and self.seed_users_path and os.path.exists(self.seed_users_path):
+            with open(self.seed_users_path, 'r') as file:
+                self.import_users(json.load(file))
+            self.db.commit()
+            logging.info("Imported users from %s", self.seed_users_path)
+
+    def import_users(self, users: dict[str, dict]) -> None:
+        """
+        Adds users in the JSON storage format to the database
+        :param users: Dict of usernames and their password, score and questions asked
+        :return: None
+        """
+        self.db.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?)",
+                            ((name, user["password"], user["score"]) for name, user in users.items()))
+        self.db.executemany("INSERT OR IGNORE INTO questions_asked VALUES (?, ?)",
+                            ((name, question_id) for name, user in users.items()
+                             for question_id in unpack_question_ids(user["questions_asked"])))
+
+    def get_password(self, username: str) -> str | None:
+        row = self.db.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_score(self, username: str) -> int:
+        return self.db.execute("SELECT score FROM users WHERE username = ?", (username,)).fetchone()[0]
+
+    def get_questions_asked(self, username: str) -> set[str]:
+        rows = self.db.execute("SELECT question_id FROM questions_asked WHERE username = ?", (username,))
+        return {question_id for question_id, in rows}
+
+    def record_answer(self, username: str, question_id: str, points: int) -> None:
+        self.db.execute("INSERT OR IGNORE INTO questions_asked VALUES (?, ?)", (username, question_id))
+        if points:
+            self.db.execute("UPDATE users SET score = score + ? WHERE username = ?", (points, username))
+
+    def top_scores(self, count: int) -> list[tuple[str, int]]:
+        # Walks the score index, no sorting needed
+        return self.db.execute("SELECT username, score FROM users ORDER BY score DESC LIMIT ?", (count,)).fetchall()
+
+    def set_questions(self, questions: dict[str, dict]) -> None:
+        self.db.executemany(
+            "INSERT OR REPLACE INTO questions VALUES (?, ?, ?, ?)",
+            ((question_id, question["question"], question["correct_answer"], json.dumps(question["incorrect_answers"]))
+             for question_id, question in questions.items()))
+        self.db.commit()
+
+    def get_question(self, question_id: str) -> dict | None:
+        row = self.db.execute("SELECT question, correct_answer, incorrect_answers FROM questions "
+                              "WHERE question_id = ?", (question_id,)).fetchone()
+        if row is None:
+            return None
+
+        question, correct_answer, incorrect_answers = row
+        return {"question": question, "correct_answer": correct_answer,
+                "incorrect_answers": json.loads(incorrect_answers)}
+
+    def question_ids(self) -> list[str]:
+        return [question_id for question_id, in self.db.execute("SELECT question_id FROM questions")]
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,129 @@
+# Checks of the users file's packed question IDs and of the answers journal, like chatlib_test.py
+import json
+import os
+import tempfile
+import storage
+
+
+def check_pack(question_ids, expected_output):
+    print("Input: ", question_ids, "\nExpected output: ", expected_output)
+    try:
+        output = storage.pack_question_ids(question_ids)
+    except Exception as e:
+        output = "Exception raised: " + str(e)
+
+    if output == expected_output:
+        print(".....\t SUCCESS")
+    else:
+        print(".....\t FAILED, output: ", output)
+
+
+def check_unpack(encoded, expected_output):
+    print("Input: ", encoded, "\nExpected output: ", expected_output)
+    try:
+        output = storage.unpack_question_ids(encoded)
+    except Exception as e:
+        output = "Exception raised: " + str(e)
+
+    if output == expected_output:
+        print(".....\t SUCCESS")
+    else:
+        print(".....\t FAILED, output: ", output)
+
+
+def check_replay(journal_text, expected_output):
+    """
+    Replays a journal on top of one user with score 0, checks the user's score and asked questions
+    """
+    print("Input: ", repr(journal_text), "\nExpected output: ", expected_output)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            journal_path = os.path.join(directory, "journal.jsonl")
+            with open(journal_path, 'w') as file:
+                file.write(journal_text)
+            json_storage = storage.JsonStorage(os.path.join(directory, "users.json"), journal_path)
+            json_storage.users = {"test": {"password": "test", "score": 0, "questions_asked": set()}}
+            json_storage.replay_journal_file(journal_path)
+            user = json_storage.users["test"]
+            output = (user["score"], user["questions_asked"], json_storage.journal_records)
+    except Exception as e:
+        output = "Exception raised: " + str(e)
+
+    if output == expected_output:
+        print(".....\t SUCCESS")
+    else:
+        print(".....\t FAILED, output: ", output)
+
+
+def check_restart(journal_text, expected_output):
+    """
+    Loads a storage from a journal, answers once, then loads it again and checks the user's score
+    """
+    print("Input: ", repr(journal_text), "\nExpected output: ", expected_output)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            users_path, journal_path = os.path.join(directory, "users.json"), os.path.join(directory, "journal.jsonl")
+            with open(users_path, 'w') as file:
+                json.dump({"test": {"password": "test", "score": 0, "questions_asked": []}}, file)
+            with open(journal_path, 'w') as file:
+                file.write(journal_text)
+            json_storage = storage.JsonStorage(users_path, journal_path)
+            json_storage.load()
+            json_storage.record_answer("test", "6234", 5)
+            json_storage.commit()
+            json_storage.journal_file.close()  # Like a crash, without a snapshot
+
+            json_storage = storage.JsonStorage(users_path, journal_path)
+            json_storage.load()
+            json_storage.journal_file.close()
+            output = json_storage.get_score("test")
+    except Exception as e:
+        output = "Exception raised: " + str(e)
+
+    if output == expected_output:
+        print(".....\t SUCCESS")
+    else:
+        print(".....\t FAILED, output: ", output)
+
+
+def record(username, question_id, points, score):
+    return json.dumps([username, question_id, points, score]) + "\n"
+
+
+def main():
+    # PACKED QUESTION IDS
+
+    # Valid inputs
+    check_pack(set(), "")
+    check_pack({"0a94fa35"}, "CpT6NQ==")
+    check_pack({"2313"}, {"packed": "", "other": ["2313"]})  # Not 8 hex digits
+    check_pack({"0a94fa35", "2313", "ABCDEF12"}, {"packed": "CpT6NQ==", "other": ["2313", "ABCDEF12"]})
+    check_unpack("CpT6NQ==", {"0a94fa35"})
+    check_unpack({"packed": "CpT6NQ==", "other": ["2313"]}, {"0a94fa35", "2313"})
+    check_unpack(["2313", "4122"], {"2313", "4122"})  # Old plain list format
+    # Round trip
+    ids = {"%08x" % (index * 2654435761 % 2 ** 32) for index in range(1000)} | {"2313", "4122"}
+    check_unpack(storage.pack_question_ids(ids), ids)
+
+    # JOURNAL REPLAY
+
+    # Valid inputs
+    check_replay("", (0, set(), 0))
+    check_replay(record("test", "2313", 5, 5) + record("test", "4122", 0, 5), (5, {"2313", "4122"}, 2))
+    # Replaying records that are already in the snapshot changes nothing
+    check_replay(record("test", "2313", 5, 5) + record("test", "2313", 5, 5), (5, {"2313"}, 2))
+    check_replay(record("nobody", "2313", 5, 5), (0, set(), 0))  # Deleted user
+
+    # Invalid inputs
+    # The server crashed in the middle of writing the last record
+    check_replay(record("test", "2313", 5, 5) + '["test","41', (5, {"2313"}, 1))
+    check_replay('["test","41\n' + record("test", "2313", 5, 5), (5, {"2313"}, 1))
+    check_replay(record("test", "2313", 5, 5)[:-1] + "\0\0\0", (0, set(), 0))
+    # Records written after restarting from a torn journal are replayed too
+    check_restart("", 5)
+    check_restart(record("test", "2313", 5, 5), 10)
+    check_restart(record("test", "2313", 5, 5) + '["test","41', 10)
+
+
+if __name__ == '__main__':
+    main()
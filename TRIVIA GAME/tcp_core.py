@@ -0,0 +1,11 @@
+"""
+The server core shared with the TCP templates (see tcp_server.py there).
+Every module of the game imports it from here, so the templates' folder is on the path first
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "TCP templates"))
+import tcp_server
+
+__all__ = ["tcp_server"]